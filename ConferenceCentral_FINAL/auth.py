@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+auth.py -- Udacity conference server-side Python App Engine
+    request-scoped auth context & in-instance caches of verified tokens
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+import hashlib
+
+import endpoints
+
+from utils import TTLCache
+from utils import getUserId
+
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_TTL = 300
+CERT_CACHE_SIZE = 10
+CERT_CACHE_TTL = 600
+
+
+class AuthContext(object):
+    """The signed in user of one request. endpoints.get_current_user()
+    and getUserId() are called at most once, however many times the
+    request asks."""
+
+    def __init__(self):
+        self._resolved = False
+        self._user = None
+        self._userId = None
+
+    @property
+    def user(self):
+        """The current user, or None if not signed in."""
+        if not self._resolved:
+            self._user = endpoints.get_current_user()
+            self._resolved = True
+        return self._user
+
+    @property
+    def userId(self):
+        """The current user's id, or None if not signed in."""
+        if self._userId is None and self.user:
+            self._userId = getUserId(self.user)
+        return self._userId
+
+    def requireUser(self):
+        """Return the current user; raise UnauthorizedException if none."""
+        if not self.user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return self.user
+
+
+def currentUser(method, api_info):
+    """Return the signed in user of a plain webapp2 request, checking its
+    Authorization header as Endpoints would for method of the API
+    described by api_info; or None if not signed in. The library only
+    does this for its own requests, so its helper is called directly; if
+    it isn't there (a different library version), nobody is signed in."""
+    try:
+        from endpoints import users_id_token
+    except ImportError:
+        return None
+    setUserVars = getattr(users_id_token, '_maybe_set_current_user_vars',
+        None)
+    if not setUserVars:
+        return None
+    setUserVars(method, api_info=api_info)
+    return endpoints.get_current_user()
+
+
+# - - - Token verification caches - - - - - - - - - - - - - -
+
+# keyed by a digest of the token, so raw tokens aren't kept in memory
+VERIFIED_TOKENS = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+SIGNING_CERTS = TTLCache(CERT_CACHE_SIZE, CERT_CACHE_TTL)
+
+
+def _cachedVerify(verify):
+    """Wrap the endpoints ID token verifier with VERIFIED_TOKENS."""
+    def cachedVerify(jwt, time_now, cache, *args, **kwargs):
+        key = hashlib.sha256(jwt).hexdigest()
+        parsed = VERIFIED_TOKENS.get(key)
+        if parsed is not None and time_now < parsed.get('exp', 0):
+            return parsed
+        # only tokens that pass verification are cached
+        parsed = verify(jwt, time_now, cache, *args, **kwargs)
+        VERIFIED_TOKENS.set(key, parsed,
+            min(TOKEN_CACHE_TTL, parsed.get('exp', 0) - time_now))
+        return parsed
+    return cachedVerify
+
+
+def _cachedCerts(getCerts):
+    """Wrap the endpoints signing certificate lookup with SIGNING_CERTS."""
+    def cachedCerts(cert_uri, cache, *args, **kwargs):
+        certs = SIGNING_CERTS.get(cert_uri)
+        if certs is None:
+            certs = getCerts(cert_uri, cache, *args, **kwargs)
+            if certs is not None:
+                SIGNING_CERTS.set(cert_uri, certs)
+        return certs
+    return cachedCerts
+
+
+def cacheTokenVerification():
+    """Put the in-instance caches in front of the endpoints library's ID
+    token verification, which checks an RSA signature and looks the
+    certificates up in memcache on every request. The library has no
+    hook for this, so its helpers are wrapped; if they aren't there (a
+    different library version), nothing is changed."""
+    try:
+        from endpoints import users_id_token
+    except ImportError:
+        return
+    verify = getattr(users_id_token, '_verify_signed_jwt_with_certs', None)
+    if verify and not getattr(verify, 'cached', False):
+        users_id_token._verify_signed_jwt_with_certs = _cachedVerify(verify)
+        users_id_token._verify_signed_jwt_with_certs.cached = True
+    getCerts = getattr(users_id_token, '_get_cached_certs', None)
+    if getCerts and not getattr(getCerts, 'cached', False):
+        users_id_token._get_cached_certs = _cachedCerts(getCerts)
+        users_id_token._get_cached_certs.cached = True
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+bench_copiers.py -- Udacity conference server-side Python App Engine
+    time to copy in-memory Conferences & Sessions to their forms
+
+Compares:
+  reflective  _copyConferenceToForm & _copySessionToForm as they were
+              before the copiers, on the models and forms of that time
+  copier      copyConferenceToForm & copySessionToForm, built once by
+              makeFormCopier
+
+    python benchmarks/bench_copiers.py --sdk ~/google_appengine --records 10000
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+from datetime import date
+from datetime import time
+
+import stubs
+
+
+def main():
+    parser = stubs.optionParser('%prog [options]')
+    parser.add_option('--records', type='int', default=10000)
+    parser.add_option('--repeat', type='int', default=5)
+    options, _ = parser.parse_args()
+    stubs.setUpSdk(options.sdk)
+    tb, _ = stubs.activateTestbed()
+
+    from google.appengine.ext import ndb
+    from protorpc import messages
+    from conference import copyConferenceToForm
+    from conference import copySessionToForm
+    from models import Conference
+    from models import Profile
+    from models import Session
+    from models import SessionForm
+
+    # the models and form of that time: Sessions stored their conference's
+    # websafe key, and Conferences had no organizer name or version
+    class BaselineConference(ndb.Model):
+        name            = ndb.StringProperty(required=True)
+        description     = ndb.StringProperty()
+        organizerUserId = ndb.StringProperty()
+        topics          = ndb.StringProperty(repeated=True)
+        city            = ndb.StringProperty()
+        startDate       = ndb.DateProperty()
+        month           = ndb.IntegerProperty()
+        endDate         = ndb.DateProperty()
+        maxAttendees    = ndb.IntegerProperty()
+        seatsAvailable  = ndb.IntegerProperty()
+
+    class BaselineConferenceForm(messages.Message):
+        name            = messages.StringField(1)
+        description     = messages.StringField(2)
+        organizerUserId = messages.StringField(3)
+        topics          = messages.StringField(4, repeated=True)
+        city            = messages.StringField(5)
+        startDate       = messages.StringField(6)
+        month           = messages.IntegerField(7)
+        maxAttendees    = messages.IntegerField(8)
+        seatsAvailable  = messages.IntegerField(9)
+        endDate         = messages.StringField(10)
+        websafeKey      = messages.StringField(11)
+        organizerDisplayName = messages.StringField(12)
+
+    class BaselineSession(ndb.Model):
+        websafeConferenceKey    = ndb.StringProperty()
+        name                    = ndb.StringProperty(required=True)
+        highlights              = ndb.StringProperty()
+        speaker                 = ndb.StringProperty()
+        duration                = ndb.IntegerProperty()
+        typeOfSession           = ndb.StringProperty(repeated=True)
+        date                    = ndb.DateProperty()
+        startTime               = ndb.TimeProperty()
+
+    # the copiers as they were before makeFormCopier
+    def reflectiveConferenceToForm(conf, displayName):
+        cf = BaselineConferenceForm()
+        for field in cf.all_fields():
+            if hasattr(conf, field.name):
+                # convert Date to date string; just copy others
+                if field.name.endswith('Date'):
+                    setattr(cf, field.name, str(getattr(conf, field.name)))
+                else:
+                    setattr(cf, field.name, getattr(conf, field.name))
+            elif field.name == "websafeKey":
+                setattr(cf, field.name, conf.key.urlsafe())
+        if displayName:
+            setattr(cf, 'organizerDisplayName', displayName)
+        cf.check_initialized()
+        return cf
+
+    def reflectiveSessionToForm(sess):
+        sf = SessionForm()
+        for field in sf.all_fields():
+            if hasattr(sess, field.name):
+                # convert Date to date string; just copy others
+                if field.name == 'date':
+                    setattr(sf, field.name, str(getattr(sess, field.name)))
+                elif field.name == 'startTime':
+                    setattr(sf, field.name, str(getattr(sess, field.name)))
+                else:
+                    setattr(sf, field.name, getattr(sess, field.name))
+            elif field.name == "websafeConferenceKey":
+                setattr(sf, field.name, sess.key.urlsafe())
+        sf.check_initialized()
+        return sf
+
+    # entities with keys, as fetched; nothing is written
+    p_key = ndb.Key(Profile, 'organizer')
+    conference = dict(description='A conference',
+        organizerUserId=p_key.id(), topics=['Programming Languages', 'Web'],
+        city='London', startDate=date(2016, 5, 1), month=5,
+        endDate=date(2016, 5, 3), maxAttendees=100, seatsAvailable=50)
+    session = dict(highlights='Highlights', speaker='Speaker', duration=60,
+        typeOfSession=['Workshop'], date=date(2016, 5, 1),
+        startTime=time(9, 30))
+    confs = [Conference(key=ndb.Key(Conference, i + 1, parent=p_key),
+        name='Conference %d' % i, organizerDisplayName='Organizer',
+        version=1, **conference)
+        for i in range(options.records)]
+    sessions = [Session(key=ndb.Key(Session, i + 1, parent=confs[i].key),
+        name='Session %d' % i, **session)
+        for i in range(options.records)]
+    baseline_confs = [BaselineConference(
+        key=ndb.Key(BaselineConference, i + 1, parent=p_key),
+        name='Conference %d' % i, **conference)
+        for i in range(options.records)]
+    baseline_sessions = [BaselineSession(
+        key=ndb.Key(BaselineSession, i + 1, parent=baseline_confs[i].key),
+        websafeConferenceKey=baseline_confs[i].key.urlsafe(),
+        name='Session %d' % i, **session)
+        for i in range(options.records)]
+
+    print '%d records' % options.records
+    for name, func in [
+            ('conferences, reflective',
+                lambda: [reflectiveConferenceToForm(conf, 'Organizer')
+                    for conf in baseline_confs]),
+            ('conferences, copier',
+                lambda: [copyConferenceToForm(conf) for conf in confs]),
+            ('sessions, reflective',
+                lambda: [reflectiveSessionToForm(sess)
+                    for sess in baseline_sessions]),
+            ('sessions, copier',
+                lambda: [copySessionToForm(sess) for sess in sessions])]:
+        stubs.report(name, stubs.timeit(func, options.repeat))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
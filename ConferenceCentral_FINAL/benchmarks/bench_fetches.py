@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+bench_fetches.py -- Udacity conference server-side Python App Engine
+    latency of getConference and of a page of queryConferences, called
+    through ConferenceApi against the local datastore stub
+
+Runs each method:
+  datastore   with ndb's caches off and the query cache flushed, so every
+              call reads the datastore
+  cached      as deployed: ndb's memcache and the query result cache on
+
+and prints the datastore RPCs each call made. The organizer's name is
+read from the Conference, so there is no Profile fetch to wait for.
+
+    python benchmarks/bench_fetches.py --sdk ~/google_appengine --latency 0.02
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+import stubs
+
+
+def main():
+    parser = stubs.optionParser('%prog [options]')
+    parser.add_option('--latency', type='float', default=0.02,
+        help='seconds per datastore RPC')
+    parser.add_option('--conferences', type='int', default=100)
+    parser.add_option('--page-size', type='int', default=20)
+    parser.add_option('--repeat', type='int', default=50)
+    options, _ = parser.parse_args()
+    stubs.setUpSdk(options.sdk)
+    tb, datastore = stubs.activateTestbed(options.latency)
+
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    from conference import CONF_GET_REQUEST
+    from conference import ConferenceApi
+    from models import Conference
+    from models import ConferenceQueryForms
+    from models import Profile
+
+    # organizers' conferences are children of their Profiles
+    c_keys = []
+    for i in range(options.conferences):
+        p_key = ndb.Key(Profile, 'organizer%d' % (i % 10))
+        Profile(key=p_key, displayName='Organizer %d' % (i % 10)).put()
+        c_keys.append(Conference(parent=p_key, name='Conference %03d' % i,
+            organizerUserId=p_key.id(),
+            organizerDisplayName='Organizer %d' % (i % 10)).put())
+
+    api = ConferenceApi()
+    get_request = CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=c_keys[0].urlsafe())
+    query_request = ConferenceQueryForms(pageSize=options.page_size)
+
+    def getConference():
+        api.getConference(get_request)
+
+    def queryConferences():
+        api.queryConferences(query_request)
+
+    def uncached(func):
+        def call():
+            memcache.flush_all()
+            func()
+        return call
+
+    print 'datastore RPC latency %.0f ms' % (options.latency * 1000)
+    ctx = ndb.get_context()
+    for caching, wrap in [('datastore', uncached), ('cached', None)]:
+        ctx.set_cache_policy(caching == 'cached')
+        ctx.set_memcache_policy(caching == 'cached')
+        ctx.clear_cache()
+        memcache.flush_all()
+        for name, func in [
+                ('getConference', getConference),
+                ('queryConferences page', queryConferences)]:
+            func = wrap(func) if wrap else func
+            datastore.reset()
+            times = stubs.timeit(func, options.repeat)
+            stubs.report('%s, %s' % (name, caching), times)
+            print '%-40s %s' % ('', ', '.join('%s %.2f' % (call,
+                float(count) / options.repeat)
+                for call, count in sorted(datastore.calls.items())) or
+                'no datastore RPCs')
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
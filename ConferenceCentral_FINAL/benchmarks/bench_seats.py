@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+bench_seats.py -- Udacity conference server-side Python App Engine
+    registrations for one conference from many concurrent users, against
+    the local datastore stub
+
+Compares:
+  conference  each registration decrements Conference.seatsAvailable in a
+              transaction on the Conference's entity group, as before the
+              seat shards
+  shards      each registration takes a seat from a random SeatShard with
+              free seats, through ConferenceApi._takeSeat
+
+and checks that neither hands out more seats than the conference has.
+
+    python benchmarks/bench_seats.py --sdk ~/google_appengine --threads 20
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+import threading
+import time
+
+import stubs
+
+
+def main():
+    parser = stubs.optionParser('%prog [options]')
+    parser.add_option('--latency', type='float', default=0.02,
+        help='seconds per datastore RPC')
+    parser.add_option('--threads', type='int', default=20)
+    parser.add_option('--registrations', type='int', default=200,
+        help='users registering, split between the threads')
+    parser.add_option('--seats', type='int', default=150)
+    options, _ = parser.parse_args()
+    stubs.setUpSdk(options.sdk)
+    tb, datastore = stubs.activateTestbed(options.latency)
+
+    from google.appengine.api import datastore_errors
+    from google.appengine.ext import ndb
+    from conference import ConferenceApi
+    from conference import NUM_SEAT_SHARDS
+    from models import Conference
+    from models import Profile
+    from models import Registration
+
+    api = ConferenceApi()
+    organizer = ndb.Key(Profile, 'organizer')
+
+    def makeConference(name, seatShards):
+        conf = Conference(parent=organizer, name=name,
+            organizerUserId=organizer.id(), maxAttendees=options.seats,
+            seatsAvailable=options.seats, seatShards=seatShards)
+        conf.put()
+        if seatShards:
+            ndb.put_multi(api._makeSeatShards(conf))
+        return conf
+
+    @ndb.transactional(xg=True)
+    def registerOnConference(p_key, c_key):
+        prof, conf = ndb.get_multi([p_key, c_key])
+        prof = prof or Profile(key=p_key)
+        if conf.seatsAvailable <= 0:
+            return False
+        prof.conferenceKeysToAttend.append(c_key.urlsafe())
+        conf.seatsAvailable -= 1
+        ndb.put_multi([prof, conf])
+        return True
+
+    def registerOnShards(p_key, c_key):
+        conf = c_key.get()
+        reg_key = ndb.Key(Registration, c_key.urlsafe(), parent=p_key)
+        return api._takeSeat(reg_key, c_key, api._seatShardKeys(conf))
+
+    def seatsTaken(conf):
+        # this thread's context cache still holds the entities as created
+        if conf.seatShards:
+            shards = ndb.get_multi(api._seatShardKeys(conf), use_cache=False,
+                use_memcache=False)
+            return options.seats - sum(s.seatsAvailable for s in shards)
+        return options.seats - conf.key.get(use_cache=False,
+            use_memcache=False).seatsAvailable
+
+    def run(name, register, conf):
+        results = {'registered': 0, 'sold out': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def worker(users):
+            # every thread gets its own ndb context
+            ndb.get_context().set_cache_policy(False)
+            for user in users:
+                p_key = ndb.Key(Profile, '%s-user%d' % (name, user))
+                try:
+                    result = 'registered' if register(p_key, conf.key) \
+                        else 'sold out'
+                except datastore_errors.TransactionFailedError:
+                    result = 'failed'
+                with lock:
+                    results[result] += 1
+
+        users = range(options.registrations)
+        threads = [threading.Thread(target=worker,
+            args=(users[i::options.threads],))
+            for i in range(options.threads)]
+        datastore.reset()
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        taken = seatsTaken(conf)
+        print '%-12s %6.2f s   %4d registered  %4d sold out  %4d failed' \
+            '   %5d commit conflicts' % (name, elapsed,
+            results['registered'], results['sold out'], results['failed'],
+            datastore.errors['Commit'])
+        if taken != results['registered'] or taken > options.seats:
+            print '%-12s %d seats taken for %d registrations of %d seats' % (
+                '  OVERSOLD', taken, results['registered'], options.seats)
+
+    print '%d users, %d threads, %d seats, datastore RPC latency %.0f ms' % (
+        options.registrations, options.threads, options.seats,
+        options.latency * 1000)
+    run('conference', registerOnConference, makeConference('Unsharded', 0))
+    run('shards', registerOnShards,
+        makeConference('Sharded', NUM_SEAT_SHARDS))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+stubs.py -- Udacity conference server-side Python App Engine
+    App Engine SDK testbed set up shared by the benchmark scripts
+
+The scripts run the app's code against the SDK's local service stubs.
+Pass the SDK directory with --sdk, or set APPENGINE_SDK.
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+import collections
+import optparse
+import os
+import sys
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def optionParser(usage):
+    """Return an OptionParser with the options every benchmark takes."""
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--sdk', default=os.environ.get('APPENGINE_SDK'),
+        help='App Engine SDK directory (default: $APPENGINE_SDK)')
+    return parser
+
+
+def setUpSdk(sdk):
+    """Put the SDK, its bundled libraries and the app on sys.path."""
+    if sdk:
+        sys.path.insert(0, sdk)
+    try:
+        import dev_appserver
+    except ImportError:
+        sys.exit('App Engine SDK not found; pass --sdk or set APPENGINE_SDK')
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, APP_DIR)
+
+
+def activateTestbed(latency=0):
+    """Activate a testbed with the stubs the app uses; every datastore
+    RPC takes at least latency seconds. Returns the testbed and the
+    datastore's LatentStub."""
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    # endpoints.api_server wants a 'major.minor' version id
+    tb.setup_env(current_version_id='testbed.1', overwrite=True)
+    # strongly consistent, like the ancestor queries the app relies on
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy, require_indexes=False)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=APP_DIR)
+    tb.init_urlfetch_stub()
+    tb.init_user_stub()
+    tb.init_app_identity_stub()
+    tb.init_mail_stub()
+
+    stub = LatentStub(apiproxy_stub_map.apiproxy.GetStub('datastore_v3'),
+        latency)
+    apiproxy_stub_map.apiproxy.ReplaceStub('datastore_v3', stub)
+    ndb.get_context().clear_cache()
+    return tb, stub
+
+
+class _CountingStub(object):
+    """Forward calls to a stub, counting them and their errors by method."""
+
+    def __init__(self, stub):
+        self._stub = stub
+        self._lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+
+    def MakeSyncCall(self, service, call, request, response, *args):
+        with self._lock:
+            self.calls[call] += 1
+        try:
+            return self._stub.MakeSyncCall(service, call, request, response,
+                *args)
+        except Exception:
+            with self._lock:
+                self.errors[call] += 1
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._stub, name)
+
+
+class LatentStub(object):
+    """A stand-in for a service stub whose RPCs take at least latency
+    seconds, as they do against the real datastore.
+
+    The stubs answer an RPC only when it is waited on, so RPCs made
+    together would run one after the other. Here each RPC waits out its
+    latency on a timer from the moment it is made, then the stub runs:
+    RPCs in flight together overlap, as they would in production."""
+
+    def __init__(self, stub, latency):
+        self.latency = latency
+        self.counting = _CountingStub(stub)
+
+    @property
+    def calls(self):
+        return self.counting.calls
+
+    @property
+    def errors(self):
+        return self.counting.errors
+
+    def reset(self):
+        self.counting.calls.clear()
+        self.counting.errors.clear()
+
+    def CreateRPC(self):
+        return _latentRPC(self.counting, self.latency)
+
+    def MakeSyncCall(self, service, call, request, response, *args):
+        time.sleep(self.latency)
+        return self.counting.MakeSyncCall(service, call, request, response,
+            *args)
+
+    def __getattr__(self, name):
+        return getattr(self.counting, name)
+
+
+def _latentRPC(stub, latency):
+    """Return an RPC for stub that can't finish until latency seconds
+    after it is made."""
+    from google.appengine.api import apiproxy_rpc
+
+    class LatentRPC(apiproxy_rpc.RPC):
+        def _MakeCallImpl(self):
+            apiproxy_rpc.RPC._MakeCallImpl(self)
+            self._arrived = threading.Event()
+            timer = threading.Timer(latency, self._arrived.set)
+            timer.daemon = True
+            timer.start()
+
+        def _WaitImpl(self):
+            self._arrived.wait()
+            return apiproxy_rpc.RPC._WaitImpl(self)
+
+    return LatentRPC(stub=stub)
+
+
+def timeit(func, repeat):
+    """Call func repeat times; return the run times in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append((time.time() - start) * 1000)
+    return times
+
+
+def report(name, times):
+    """Print the median and mean of a list of run times."""
+    times = sorted(times)
+    print '%-40s median %8.2f ms   mean %8.2f ms   (%d runs)' % (name,
+        times[len(times) // 2], sum(times) / len(times), len(times))
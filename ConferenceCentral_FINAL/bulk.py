@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+
+"""
+bulk.py -- Udacity conference server-side Python App Engine
+    bulk import & export of Conference, Session, Profile and Registration
+    entities
+
+Records are read and written as JSON lines or CSV; in CSV, repeated
+fields (topics, typeOfSession, ...) are separated by ';'.
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+import csv
+import json
+
+from datetime import date
+from datetime import datetime
+from datetime import time
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from conference import DEFAULTS
+from conference import MAX_SESSIONS_PER_REQUEST
+from conference import NUM_SEAT_SHARDS
+from conference import PROFILES
+from models import Conference
+from models import Profile
+from models import Registration
+from models import Session
+from models import TeeShirtSize
+from settings import ROOT_CONFERENCE_KEYS
+
+IMPORT_BATCH_SIZE = 500
+EXPORT_PAGE_SIZE = 1000
+LIST_SEPARATOR = ';'
+
+KINDS = {
+    'conference': Conference,
+    'session': Session,
+    'profile': Profile,
+    'registration': Registration,
+}
+
+
+# - - - Reading & writing records - - - - - - - - - - - - - -
+
+def readRecords(fileobj, fmt):
+    """Yield the records in a JSONL or CSV file as dicts, one at a time."""
+    # a request's body_file has readline but can't be iterated
+    lines = iter(fileobj.readline, '')
+    if fmt == 'jsonl':
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    elif fmt == 'csv':
+        for row in csv.DictReader(lines):
+            # empty CSV cells mean "not set"
+            yield dict((name, value.decode('utf-8'))
+                for name, value in row.items() if name and value)
+    else:
+        raise ValueError("Unknown format: %s" % fmt)
+
+
+def _csvFields(model):
+    """Return the CSV columns for a model, in a stable order."""
+    fields = ['websafeKey'] + sorted(prop._code_name
+        for prop in model._properties.values())
+    if model in (Profile, Registration):
+        fields.insert(1, 'userId')
+    elif model is Session:
+        fields.insert(1, 'websafeConferenceKey')
+    return fields
+
+
+def _recordFromEntity(entity):
+    """Return an entity as a dict of JSON friendly values."""
+    record = {}
+    for name, value in entity.to_dict().items():
+        values = value if isinstance(value, list) else [value]
+        values = [v.urlsafe() if isinstance(v, ndb.Key) else
+            v.isoformat() if isinstance(v, (date, datetime, time)) else v
+            for v in values]
+        record[name] = values if isinstance(value, list) else values[0]
+    record['websafeKey'] = entity.key.urlsafe()
+    if isinstance(entity, Profile):
+        record['userId'] = entity.key.id()
+    elif isinstance(entity, Registration):
+        # a Registration is a child of the attendee's Profile
+        record['userId'] = entity.key.parent().id()
+    elif isinstance(entity, Session):
+        # the conference is the Session's parent, so it can be imported
+        record['websafeConferenceKey'] = entity.key.parent().urlsafe()
+    return record
+
+
+def writeRecords(entities, fmt, out, header=False):
+    """Write entities to out as JSONL or CSV."""
+    if fmt == 'jsonl':
+        for entity in entities:
+            out.write(json.dumps(_recordFromEntity(entity)))
+            out.write('\n')
+    elif fmt == 'csv':
+        writer = None
+        for entity in entities:
+            if not writer:
+                fields = _csvFields(type(entity))
+                writer = csv.DictWriter(out, fields, extrasaction='ignore')
+                if header:
+                    writer.writerow(dict(zip(fields, fields)))
+            record = _recordFromEntity(entity)
+            for name, value in record.items():
+                if isinstance(value, list):
+                    value = LIST_SEPARATOR.join(value)
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                record[name] = value
+            writer.writerow(record)
+    else:
+        raise ValueError("Unknown format: %s" % fmt)
+
+
+# - - - Import - - - - - - - - - - - - - - - - - - - - - - -
+
+def _toList(value):
+    """Return a list field from a JSON list or a ';' separated string."""
+    if value in (None, ''):
+        return []
+    if isinstance(value, list):
+        return value
+    return [v.strip() for v in value.split(LIST_SEPARATOR) if v.strip()]
+
+
+def _toInt(value):
+    """Return an integer field, or None if not set."""
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def _toDate(value):
+    """Return a date field from an ISO date string, or None if not set."""
+    if not value:
+        return None
+    return datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def _toTime(value):
+    """Return a time field from an HH:MM string, or None if not set."""
+    if not value:
+        return None
+    return datetime.strptime(value[:5], "%H:%M").time()
+
+
+def _toDateTime(value):
+    """Return a datetime field from an ISO string, or None if not set."""
+    if not value:
+        return None
+    return datetime.strptime(value[:19].replace(' ', 'T'), "%Y-%m-%dT%H:%M:%S")
+
+
+def _toKey(value, model):
+    """Return the key in a websafe key string; raise ValueError unless it
+    is a key of this app for an entity of model."""
+    try:
+        key = ndb.Key(urlsafe=value)
+    except Exception:
+        # a malformed string can fail in several ways inside the decoder
+        raise ValueError("Invalid key: %r" % (value,))
+    if key.kind() != model._get_kind() or key.app() != ndb.Key(model, 1).app():
+        raise ValueError("Not a %s key of this app: %s" % (
+            model._get_kind(), value))
+    return key
+
+
+def _allocateKeys(model, records, parentOf):
+    """Return a key per record: its websafeKey if it has one, otherwise
+    one of a block of ids allocated once per parent."""
+    keys = [None] * len(records)
+    by_parent = {}
+    for i, record in enumerate(records):
+        if record.get('websafeKey'):
+            keys[i] = _toKey(record['websafeKey'], model)
+        else:
+            by_parent.setdefault(parentOf(record), []).append(i)
+    for parent, indexes in by_parent.items():
+        first, last = model.allocate_ids(size=len(indexes), parent=parent)
+        for i, m_id in zip(indexes, range(first, last + 1)):
+            keys[i] = ndb.Key(model, m_id, parent=parent)
+    return keys
+
+
+def _importProfiles(records):
+    """Write a batch of Profile records, keyed by their userId. Fields a
+    record leaves out keep their current values, so importing into a live
+    app doesn't wipe what users have saved since the export."""
+    keys = [ndb.Key(Profile, record['userId']) for record in records]
+    profiles = []
+    for p_key, prof, record in zip(keys, ndb.get_multi(keys), records):
+        prof = prof or Profile(key=p_key,
+            teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED))
+        for field in ('displayName', 'mainEmail', 'teeShirtSize'):
+            if record.get(field):
+                setattr(prof, field, record[field])
+        # wishlists are exported as websafe keys, including any not yet
+        # migrated from the legacy list
+        wishlist = (_toList(record.get('sessionKeysForWishlist')) +
+            _toList(record.get('legacySessionKeysForWishlist')))
+        if wishlist:
+            prof.sessionKeysForWishlist = [_toKey(wssk, Session)
+                for wssk in wishlist]
+            prof.legacySessionKeysForWishlist = []
+        attend = _toList(record.get('conferenceKeysToAttend'))
+        if attend:
+            # still legacy; moved into Registrations on first use
+            prof.conferenceKeysToAttend = [_toKey(wsck, Conference).urlsafe()
+                for wsck in attend]
+        profiles.append(prof)
+    ndb.put_multi(profiles)
+    # don't let this instance serve the profiles as they were
+    for p_key in keys:
+        PROFILES.delete(p_key.id())
+
+
+def _importRegistrations(records):
+    """Write a batch of Registration records. They take no seats: the
+    seatsAvailable of an exported conference already counts them."""
+    registrations = []
+    for record in records:
+        c_key = _toKey(record['conference'], Conference)
+        registrations.append(Registration(
+            key=ndb.Key(Registration, c_key.urlsafe(),
+                parent=ndb.Key(Profile, record['userId'])),
+            conference=c_key,
+            created=_toDateTime(record.get('created')),
+        ))
+    ndb.put_multi(registrations)
+
+
+def _importConferences(records):
+    """Write a batch of Conference records, with their seat shards; no
+    confirmation emails are sent."""
+    keys = _allocateKeys(Conference, records,
+        lambda record: None if ROOT_CONFERENCE_KEYS else
+            ndb.Key(Profile, record['organizerUserId']))
+
+    # organizer names for the whole batch in one get_multi
+    organizer_ids = set(record['organizerUserId'] for record in records)
+    profiles = ndb.get_multi([ndb.Key(Profile, o_id) for o_id in organizer_ids])
+    names = dict((prof.key.id(), prof.displayName)
+        for prof in profiles if prof)
+
+    entities = []
+    confs = []
+    for c_key, record in zip(keys, records):
+        startDate = _toDate(record.get('startDate'))
+        maxAttendees = _toInt(record.get('maxAttendees')) or DEFAULTS['maxAttendees']
+        seatsAvailable = _toInt(record.get('seatsAvailable'))
+        if seatsAvailable is None:
+            seatsAvailable = maxAttendees
+        conf = Conference(
+            key=c_key,
+            name=record['name'],
+            description=record.get('description'),
+            organizerUserId=record['organizerUserId'],
+            organizerDisplayName=names.get(record['organizerUserId']),
+            topics=_toList(record.get('topics')) or DEFAULTS['topics'],
+            city=record.get('city') or DEFAULTS['city'],
+            startDate=startDate,
+            month=startDate.month if startDate else 0,
+            endDate=_toDate(record.get('endDate')),
+            maxAttendees=maxAttendees,
+            seatsAvailable=seatsAvailable,
+            seatShards=NUM_SEAT_SHARDS,
+        )
+        confs.append(conf)
+        entities.append(conf)
+        entities.extend(ConferenceApi._makeSeatShards(conf))
+    ndb.put_multi(entities)
+
+    ConferenceApi._bumpConferenceGeneration()
+    for conf in confs:
+        if ConferenceApi._isNearlySoldOut(conf.seatsAvailable):
+            ConferenceApi._updateNearlySoldOut(conf)
+
+
+def _importSessions(records):
+    """Write a batch of Session records and update the speaker indexes."""
+    keys = _allocateKeys(Session, records,
+        lambda record: _toKey(record['websafeConferenceKey'], Conference))
+
+    sessions = [Session(
+        key=s_key,
+        name=record['name'],
+        highlights=record.get('highlights'),
+        speaker=record.get('speaker'),
+        duration=_toInt(record.get('duration')),
+        typeOfSession=_toList(record.get('typeOfSession')),
+        date=_toDate(record.get('date')),
+        startTime=_toTime(record.get('startTime')),
+    ) for s_key, record in zip(keys, records)]
+    # each conference's sessions are written with its version & type index
+    by_conference = {}
+    for session in sessions:
+        by_conference.setdefault(session.key.parent(), []).append(session)
+    for c_key, conference_sessions in by_conference.items():
+        for i in range(0, len(conference_sessions), MAX_SESSIONS_PER_REQUEST):
+            ConferenceApi._putSessions(c_key,
+                conference_sessions[i:i + MAX_SESSIONS_PER_REQUEST])
+
+    # one index update per speaker, and per speaker & conference
+    by_speaker = {}
+    for session in sessions:
+        if session.speaker:
+            by_speaker.setdefault(session.speaker, []).append(session.key)
+    for speaker, session_keys in by_speaker.items():
+        ConferenceApi._addSessionsToSpeaker(speaker, session_keys)
+    ConferenceApi._featureSpeakers(sessions)
+
+
+IMPORTERS = {
+    'conference': _importConferences,
+    'session': _importSessions,
+    'profile': _importProfiles,
+    'registration': _importRegistrations,
+}
+
+
+def importRecords(kind, records):
+    """Import records of one kind in batches; returns how many were written."""
+    importer = IMPORTERS[kind]
+    count = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == IMPORT_BATCH_SIZE:
+            importer(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        importer(batch)
+        count += len(batch)
+    return count
+
+
+# - - - Export - - - - - - - - - - - - - - - - - - - - - - -
+
+def exportPage(kind, fmt, out, websafeCursor=None):
+    """Write one page of the entities of a kind to out, continuing from
+    websafeCursor; returns the cursor for the next page, or None."""
+    entities, cursor, more = KINDS[kind].query().fetch_page(
+        EXPORT_PAGE_SIZE, start_cursor=Cursor(urlsafe=websafeCursor or None))
+    writeRecords(entities, fmt, out, header=not websafeCursor)
+    if more and cursor:
+        return cursor.urlsafe()
+    return None
@@ -12,6 +12,12 @@ created by wesc on 2014 apr 21
 
 __author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
 
+import copy
+import hashlib
+import json
+import operator
+import random
+import re
 import time
 
 from datetime import datetime
@@ -19,16 +25,22 @@ from datetime import datetime
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+from models import AttendeeForm
+from models import AttendeeForms
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import Registration
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
@@ -36,6 +48,12 @@ from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSpeaker
+from models import FieldStatistics
+from models import FieldStatisticsRecount
+from models import MovedConference
+from models import NearlySoldOut
+from models import SeatShard
 from models import TeeShirtSize
 
 from models import Session
@@ -43,6 +61,9 @@ from models import SessionForm
 from models import SessionForms
 from models import SessionQueryForm
 from models import SessionQueryForms
+from models import SessionsVersion
+from models import SessionTypeIndex
+from models import Speaker
 from models import SESSION_CONTAINER
 from models import SPEAKER_CONTAINER
 
@@ -50,15 +71,48 @@ from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
+from settings import ROOT_CONFERENCE_KEYS
 
-from utils import getUserId
+from auth import AuthContext
+from auth import cacheTokenVerification
+from ids import IdAllocator
+from utils import TTLCache
+from utils import makeFormCopier
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKERS_KEY = "FEATURED_SPEAKERS"
+MEMCACHE_FEATURED_SPEAKER_TPL = "FEATURED_SPEAKER:%s"
+FEATURED_SPEAKER_TPL = "Featured Speaker is {} presenting sessions: {}"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+NEARLY_SOLD_OUT_SEATS = 5
+NEARLY_SOLD_OUT_KEY = ndb.Key(NearlySoldOut, 'nearlySoldOut')
+MAX_PAGE_SIZE = 100
+MEMCACHE_CONFERENCE_GENERATION_KEY = "CONFERENCE_GENERATION"
+CONFERENCE_GENERATION_TICKS = 1000000   # per second of the seed clock
+MEMCACHE_CONFERENCE_QUERY_TPL = "CONFERENCE_QUERY:%s:%s"
+CONFERENCE_QUERY_CACHE_TTL = 600
+ORGANIZER_FANOUT_BATCH_SIZE = 100
+MAX_SCANNED_CONFERENCES = 1000
+FIELD_STATISTICS_BATCH_SIZE = 500
+FIELD_STATISTICS_RECOUNT_KEY = ndb.Key(FieldStatisticsRecount, 'recount')
+SPEAKER_BACKFILL_BATCH_SIZE = 100
+NUM_SEAT_SHARDS = 10
+SEATS_UPDATE_INTERVAL = 10
+REGISTRATION_MIGRATION_BATCH_SIZE = 50
+# sessions are written in one transaction with two more entities, and
+# a commit takes at most 500 entities
+MAX_SESSIONS_PER_REQUEST = 498
+PROFILE_CACHE_SIZE = 1000
+PROFILE_CACHE_TTL = 60
+MEMCACHE_RECENT_CONFERENCES_TPL = "RECENT_CONFERENCES:%s"
+RECENT_CONFERENCES_TTL = 60
+CONFERENCE_KEY_MIGRATION_BATCH_SIZE = 5
+# long enough for the indexes to show entities written before a move
+CONFERENCE_MOVE_SETTLE_SECONDS = 30
+MOVING_CONFERENCE_MESSAGE = "This conference is being moved; try again in a minute."
+KEY_REFERENCE_MIGRATION_BATCH_SIZE = 100
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -84,11 +138,40 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+# Python equivalents of OPERATORS, for filters applied in memory
+COMPARATORS = {
+            '=':    operator.eq,
+            '>':    operator.gt,
+            '>=':   operator.ge,
+            '<':    operator.lt,
+            '<=':   operator.le,
+            '!=':   operator.ne
+            }
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+    fieldMask=messages.StringField(3),
+)
+
+FIELDS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fieldMask=messages.StringField(1),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -104,11 +187,65 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(2),
+)
+
 WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     sessionKey=messages.StringField(1),
 )
 
+# entity to form copiers, built once rather than per record;
+# convert Date & Time to strings, t-shirt string to Enum, just copy others
+CONFERENCE_CONVERTERS = {
+    'startDate': lambda conf: str(conf.startDate),
+    'endDate': lambda conf: str(conf.endDate),
+    'websafeKey': lambda conf: conf.key.urlsafe(),
+}
+copyConferenceToForm = makeFormCopier(Conference, ConferenceForm,
+    CONFERENCE_CONVERTERS)
+
+SESSION_CONVERTERS = {
+    'websafeConferenceKey': lambda sess: sess.key.parent().urlsafe(),
+    'date': lambda sess: str(sess.date),
+    'startTime': lambda sess: str(sess.startTime),
+}
+copySessionToForm = makeFormCopier(Session, SessionForm, SESSION_CONVERTERS)
+
+
+def wishlistKeys(prof):
+    """Return the Session keys in a Profile's wishlist, including websafe
+    keys saved before the wishlist held keys."""
+    return prof.sessionKeysForWishlist + [ndb.Key(urlsafe=wsk)
+        for wsk in prof.legacySessionKeysForWishlist]
+
+copyProfileToForm = makeFormCopier(Profile, ProfileForm, {
+    'teeShirtSize': lambda prof: getattr(TeeShirtSize, prof.teeShirtSize),
+    'sessionKeysForWishlist': lambda prof: [s_key.urlsafe()
+        for s_key in wishlistKeys(prof)],
+})
+
+# form fields filled from the entity key rather than a property
+KEY_FIELDS = ('websafeKey', 'websafeConferenceKey')
+
+
+# copiers for partial responses, built once per field mask
+MASKED_COPIERS = {}
+
+# Profile property values by user id, in front of ndb's memcache cache.
+# Each instance has its own, so entries are short lived; callers get
+# fresh entities built from copies, never the cached values themselves
+PROFILES = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+# new Conference & Session keys come from ids reserved in blocks
+CONFERENCE_IDS = IdAllocator(Conference)
+SESSION_IDS = IdAllocator(Session)
+
+# verify each client's ID token once per instance, not once per request
+cacheTokenVerification()
+
 
 # - - - Define subclass of remote.Service  - - - - - - - - -
 
@@ -118,33 +255,114 @@ WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    def initialize_request_state(self, request_state):
+        """Start each request with a fresh auth context."""
+        super(ConferenceApi, self).initialize_request_state(request_state)
+        self._auth = AuthContext()
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = copyConferenceToForm(conf)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
         return cf
 
 
+    def _parseFieldMask(self, mask, message):
+        """Return the names of the item fields selected by a partial
+        response mask such as 'items(name,websafeKey),nextPageToken', or
+        None if the mask selects every field."""
+        if not mask:
+            return None
+        mask = ''.join(mask.split())
+        names = set()
+        for inner in re.findall(r'items\(([^()]*)\)', mask):
+            names.update(inner.split(','))
+        for part in re.sub(r'items\([^()]*\)', '', mask).split(','):
+            if part == 'items':
+                return None
+            elif part.startswith('items/'):
+                names.add(part[len('items/'):])
+            elif part and part != 'nextPageToken':
+                raise endpoints.BadRequestException(
+                    "Invalid fieldMask: %s" % part)
+        unknown = names - set(field.name for field in message.all_fields())
+        if unknown:
+            raise endpoints.BadRequestException(
+                "Unknown fields: %s" % ', '.join(sorted(unknown)))
+        return frozenset(names)
+
+
+    def _formCopier(self, model, message, converters, fields):
+        """Return a copier filling only the given fields of message."""
+        key = (message.__name__, fields)
+        if key not in MASKED_COPIERS:
+            MASKED_COPIERS[key] = makeFormCopier(model, message, converters,
+                fields)
+        return MASKED_COPIERS[key]
+
+
+    def _conferenceCopier(self, fields):
+        """Return the Conference copier for a field mask (None for all)."""
+        if fields is None:
+            return self._copyConferenceToForm
+        return self._formCopier(Conference, ConferenceForm,
+            CONFERENCE_CONVERTERS, fields)
+
+
+    def _sessionCopier(self, fields):
+        """Return the Session copier for a field mask (None for all)."""
+        if fields is None:
+            return self._copySessionToForm
+        return self._formCopier(Session, SessionForm, SESSION_CONVERTERS,
+            fields)
+
+
+    def _projectionFor(self, model, fields, filtered=()):
+        """Return the properties a query of model can be projected on to
+        fill the given fields, or None if a field isn't an indexed, single
+        valued property (or is one filtered on by equality, which the
+        datastore can't project)."""
+        if not fields:
+            return None
+        projection = []
+        for name in sorted(fields):
+            if name in KEY_FIELDS:
+                # projection results always carry their keys
+                continue
+            prop = model._properties.get(name)
+            if (prop is None or not prop._indexed or prop._repeated
+                    or name in filtered):
+                return None
+            projection.append(name)
+        return projection or None
+
+
+    def _fetchPage(self, q, pageSize=None, cursor=None, projection=None):
+        """Return (results, next_cursor, more) for q, a page at a time if
+        pageSize is given. With a projection only the projected properties
+        are read, from the index; if no composite index serves it, the
+        full entities are read instead."""
+        options = {'projection': projection} if projection else {}
+        try:
+            if pageSize:
+                return q.fetch_page(pageSize, start_cursor=cursor, **options)
+            return q.fetch(**options), None, False
+        except (datastore_errors.NeedIndexError,
+                datastore_errors.BadRequestError):
+            if not projection:
+                raise
+            # no composite index serves this projection
+            return self._fetchPage(q, pageSize, cursor)
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user = self._auth.requireUser()
+        user_id = self._auth.userId
 
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
@@ -152,7 +370,7 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
+        del data['version']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -175,14 +393,30 @@ class ConferenceApi(remote.Service):
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
+        c_key = CONFERENCE_IDS.allocateKey(
+            parent=None if ROOT_CONFERENCE_KEYS else p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
+        # store the organizer's name on the Conference so listings don't
+        # have to look up the Profile; kept current by _doProfile
+        prof = p_key.get()
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            getattr(prof, 'displayName', None) or user.nickname()
+
+        # seats are handed out from sharded counters; see _reserveSeat
+        data['seatShards'] = NUM_SEAT_SHARDS
+        conf = Conference(**data)
+
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        ndb.put_multi([conf] + self._makeSeatShards(conf))
+        request.version = conf.version
+        if ROOT_CONFERENCE_KEYS:
+            self._rememberCreatedConference(user_id, c_key)
+        self._bumpConferenceGeneration()
+        if self._isNearlySoldOut(conf.seatsAvailable):
+            self._updateNearlySoldOut(conf)
         taskqueue.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
@@ -190,30 +424,68 @@ class ConferenceApi(remote.Service):
         return request
 
 
-    @ndb.transactional()
+    def _getConference(self, websafeConferenceKey):
+        """Return the Conference for websafeConferenceKey, following a
+        conference that has been moved to its new key; raise
+        NotFoundException if there is none."""
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+        if not conf:
+            moved = MovedConference.get_by_id(websafeConferenceKey)
+            conf = moved and moved.conference.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafeConferenceKey)
+        return conf
+
+
+    @staticmethod
+    def _checkNotMoving(c_key):
+        """Raise ConflictException while a Conference is being moved to a
+        new key; its MovedConference is written before anything is copied,
+        so a transaction that calls this can't race the copy. Every entity
+        group a transaction reads contends with the transaction's other
+        writers, so registrations check their seat shard instead (see
+        _reserveSeat)."""
+        if MovedConference.get_by_id(c_key.urlsafe()):
+            raise ConflictException(MOVING_CONFERENCE_MESSAGE)
+
+
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user = self._auth.requireUser()
+        user_id = self._auth.userId
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
         # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        # check that conference exists
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+        conf = self._getConference(request.websafeConferenceKey)
+        self._checkNotMoving(conf.key)
 
         # check that user is owner
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException('Only the owner can update the conference.')
 
+        # seats are counted by the SeatShards, so a new maxAttendees is
+        # applied to them, in a transaction, before the other fields
+        if (request.maxAttendees is not None and
+                request.maxAttendees != conf.maxAttendees):
+            if not conf.seatShards:
+                self._shardSeats(conf.key)
+            seats = conf.seatsAvailable
+            conf = self._resizeSeats(conf.key, request.maxAttendees)
+            if (self._isNearlySoldOut(seats) !=
+                    self._isNearlySoldOut(conf.seatsAvailable)):
+                self._updateNearlySoldOut(conf)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # organizerDisplayName is maintained from the organizer's
+            # Profile, the seats by the SeatShards and the version by puts
+            if field.name in ('organizerDisplayName', 'maxAttendees',
+                              'seatsAvailable', 'version'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -225,8 +497,8 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        self._bumpConferenceGeneration()
+        return self._copyConferenceToForm(conf)
 
 
     # Create a Conference 
@@ -253,39 +525,71 @@ class ConferenceApi(remote.Service):
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException('No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        conf = self._getConference(request.websafeConferenceKey)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceToForm(conf)
 
 
     # Get Conferences you have created 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(FIELDS_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        user = self._auth.requireUser()
+        user_id = self._auth.userId
+
+        # create ancestor query for all key matches for this user; root
+        # conferences are found by organizer, and the ones created in the
+        # last minute are added in case the index hasn't caught up yet
+        fields = self._parseFieldMask(request.fieldMask, ConferenceForm)
+        if ROOT_CONFERENCE_KEYS:
+            confs, _, _ = self._fetchPage(
+                Conference.query(Conference.organizerUserId == user_id),
+                projection=self._projectionFor(Conference, fields,
+                    ['organizerUserId']))
+            confs = self._addRecentConferences(user_id, confs)
+        else:
+            confs, _, _ = self._fetchPage(
+                Conference.query(ancestor=ndb.Key(Profile, user_id)),
+                projection=self._projectionFor(Conference, fields))
         # return set of ConferenceForm objects per Conference
+        copier = self._conferenceCopier(fields)
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[copier(conf) for conf in confs]
         )
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+    def _rememberCreatedConference(self, user_id, c_key):
+        """Remember a new root Conference of user_id's for a while, as the
+        organizerUserId index may not show it straight away."""
+        key = MEMCACHE_RECENT_CONFERENCES_TPL % user_id
+        recent = memcache.get(key) or []
+        memcache.set(key, recent + [c_key.urlsafe()],
+            time=RECENT_CONFERENCES_TTL)
+
+
+    def _addRecentConferences(self, user_id, confs):
+        """Return confs plus user_id's recently created conferences that
+        aren't among them yet."""
+        recent = memcache.get(MEMCACHE_RECENT_CONFERENCES_TPL % user_id)
+        if not recent:
+            return confs
+        seen = set(conf.key.urlsafe() for conf in confs)
+        missing = [ndb.Key(urlsafe=wsck) for wsck in recent if wsck not in seen]
+        return confs + [conf for conf in ndb.get_multi(missing) if conf]
+
+
+    def _getQuery(self, request, chosen=None):
+        """Return formatted query from the submitted filters, the filters
+        that have to be applied to its results in memory, and the field
+        the planner chose (see _planQuery) if there was a choice."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+        inequality_filter, filters = self._formatFilters(request.filters,
+            multipleInequalities=True)
+        inequality_filter, filters, residual = self._planQuery(filters,
+            chosen)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -293,17 +597,19 @@ class ConferenceApi(remote.Service):
         else:
             q = q.order(ndb.GenericProperty(inequality_filter))
             q = q.order(Conference.name)
+        # a != filter runs as two merged queries, which ndb can only page
+        # with cursors when the results end in key order; every index is
+        # already sorted by key last, so no extra indexes are needed
+        q = q.order(Conference.key)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], 
                 filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
-        return q
+        return q, residual, inequality_filter if residual else None
 
 
-    def _formatFilters(self, filters):
+    def _formatFilters(self, filters, multipleInequalities=False):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
         inequality_field = None
@@ -318,13 +624,22 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter value for %s must be a number." % filtr["field"])
+
             # Every operation except "=" is an inequality
             if filtr["operator"] != "=":
                 # check if inequality operation has been used in previous filters
                 # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
+                # (unless the caller plans around it) and track the first
+                # field on which the inequality operation is performed
                 if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
+                    if not multipleInequalities:
+                        raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
                 else:
                     inequality_field = filtr["field"]
 
@@ -332,63 +647,281 @@ class ConferenceApi(remote.Service):
         return (inequality_field, formatted_filters)
 
 
+    def _planQuery(self, filters, chosen=None):
+        """Choose the inequality field to send to the datastore.
+
+        The datastore allows inequalities on only one field, so when there
+        are several, the one estimated to match the fewest conferences is
+        pushed down and the others are returned to be applied in memory.
+        A later page passes the field chosen for the first one, as its
+        cursor only fits that query; it must be one of the inequalities.
+        Returns (inequality_field, datastore_filters, residual_filters).
+        """
+        inequality_fields = []
+        for filtr in filters:
+            if filtr["operator"] != "=" and filtr["field"] not in inequality_fields:
+                inequality_fields.append(filtr["field"])
+        if chosen is not None and (len(inequality_fields) < 2 or
+                                   chosen not in inequality_fields):
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        if len(inequality_fields) < 2:
+            return (inequality_fields[0] if inequality_fields else None,
+                filters, [])
+
+        if chosen is None:
+            stats = ndb.get_multi([ndb.Key(FieldStatistics, field)
+                for field in inequality_fields])
+            selectivity = {}
+            for field, stat in zip(inequality_fields, stats):
+                selectivity[field] = self._estimateSelectivity(stat,
+                    [filtr for filtr in filters if filtr["field"] == field])
+            # min() keeps the first field on ties, e.g. when there are no
+            # stats
+            chosen = min(inequality_fields,
+                key=lambda field: selectivity[field])
+
+        pushed = [filtr for filtr in filters
+            if filtr["operator"] == "=" or filtr["field"] == chosen]
+        residual = [filtr for filtr in filters
+            if filtr["operator"] != "=" and filtr["field"] != chosen]
+        return (chosen, pushed, residual)
+
+
+    @staticmethod
+    def _estimateSelectivity(stat, filters):
+        """Return the estimated fraction of conferences matching filters,
+        all on the field described by the FieldStatistics stat."""
+        if not stat or not stat.total:
+            return 1.0
+        matching = sum(count for value, count in stat.counts
+            if all(COMPARATORS[filtr["operator"]](value, filtr["value"])
+                for filtr in filters))
+        return min(1.0, float(matching) / stat.total)
+
+
+    @staticmethod
+    def _conferenceMatches(conf, filters):
+        """Return True if conf satisfies every filter; like the datastore,
+        a repeated property matches if any of its values does."""
+        for filtr in filters:
+            values = getattr(conf, filtr["field"])
+            if not isinstance(values, list):
+                values = [values]
+            compare = COMPARATORS[filtr["operator"]]
+            if not any(value is not None and compare(value, filtr["value"])
+                    for value in values):
+                return False
+        return True
+
+
+    def _scanConferences(self, q, residual, pageSize, cursor):
+        """Return up to pageSize conferences from q that match the residual
+        filters, and a token to continue from. At most
+        MAX_SCANNED_CONFERENCES entities are read, so a page may come back
+        short (or empty) with a token when few conferences match."""
+        conferences = []
+        scanned = 0
+        it = q.iter(start_cursor=cursor, produce_cursors=True)
+        for conf in it:
+            scanned += 1
+            if self._conferenceMatches(conf, residual):
+                conferences.append(conf)
+            if len(conferences) == pageSize or scanned == MAX_SCANNED_CONFERENCES:
+                break
+        next_token = None
+        if scanned and it.has_next():
+            next_token = it.cursor_after().urlsafe()
+        return conferences, next_token
+
+
+    # Use Push Tasks to recount the values of every queryable Conference
+    # field, a page of Conferences per task; run by the statistics cron job
+    # to keep _planQuery's estimates current
+    @staticmethod
+    @ndb.transactional()
+    def _startFieldStatisticsRecount():
+        """Start a recount, abandoning any that is still running."""
+        FieldStatisticsRecount(key=FIELD_STATISTICS_RECOUNT_KEY, cursor='',
+            counts={}).put()
+        taskqueue.add(params={'cursor': ''},
+            url='/tasks/update_field_statistics', transactional=True)
+
+
+    @staticmethod
+    def _recountFieldStatistics(websafeCursor):
+        """Count the field values of the page of Conferences at
+        websafeCursor."""
+        confs, cursor, more = Conference.query().fetch_page(
+            FIELD_STATISTICS_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor or None))
+        ConferenceApi._addFieldStatisticsPage(websafeCursor, confs,
+            cursor.urlsafe() if more and cursor else None)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _addFieldStatisticsPage(websafeCursor, confs, next_cursor):
+        """Add a page of Conferences to the recount and queue the next
+        page, or write the FieldStatistics after the last one. A page is
+        counted only if the recount still starts at its cursor, so a
+        retried task, or one of an abandoned recount, changes nothing."""
+        recount = FIELD_STATISTICS_RECOUNT_KEY.get()
+        if not recount or recount.cursor != websafeCursor:
+            return
+        recount.total += len(confs)
+        for field in FIELDS.values():
+            counts = dict((value, count)
+                for value, count in recount.counts.get(field, []))
+            for conf in confs:
+                values = getattr(conf, field)
+                for value in values if isinstance(values, list) else [values]:
+                    counts[value] = counts.get(value, 0) + 1
+            recount.counts[field] = sorted([value, count]
+                for value, count in counts.items())
+
+        if next_cursor:
+            recount.cursor = next_cursor
+            recount.put()
+            taskqueue.add(params={'cursor': next_cursor},
+                url='/tasks/update_field_statistics', transactional=True)
+        else:
+            ndb.put_multi([FieldStatistics(id=field, total=recount.total,
+                counts=counts) for field, counts in recount.counts.items()])
+            recount.key.delete()
+
+
+    def _getPageCursor(self, request, pageToken=None):
+        """Check request.pageSize and return the Cursor for pageToken
+        (default request.pageToken)."""
+        if request.pageSize is not None:
+            if request.pageSize < 1 or request.pageSize > MAX_PAGE_SIZE:
+                raise endpoints.BadRequestException(
+                    "pageSize must be between 1 and %d" % MAX_PAGE_SIZE)
+        try:
+            return Cursor(urlsafe=pageToken or request.pageToken)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+
+    @staticmethod
+    def _getConferenceGeneration():
+        """Return the current conference generation from memcache."""
+        generation = memcache.get(MEMCACHE_CONFERENCE_GENERATION_KEY)
+        if generation is None:
+            ConferenceApi._seedConferenceGeneration()
+            generation = memcache.get(MEMCACHE_CONFERENCE_GENERATION_KEY)
+        return generation
+
+
+    @staticmethod
+    def _seedConferenceGeneration():
+        """Start the generation counter again after memcache lost it.
+
+        The counter moves by one per bump, and the seed by
+        CONFERENCE_GENERATION_TICKS per second, so a new seed is above
+        every value the lost counter reached unless it averaged that many
+        bumps a second since it was seeded; only then could a new key
+        match a cache entry written before the counter was lost."""
+        memcache.add(MEMCACHE_CONFERENCE_GENERATION_KEY,
+            int(time.time() * CONFERENCE_GENERATION_TICKS))
+
+
+    @staticmethod
+    def _bumpConferenceGeneration():
+        """Invalidate all cached conference query results."""
+        def bump():
+            if memcache.incr(MEMCACHE_CONFERENCE_GENERATION_KEY) is None:
+                ConferenceApi._seedConferenceGeneration()
+        # inside a transaction, wait for the commit so that readers can't
+        # re-cache the old data under the new generation
+        ndb.get_context().call_on_commit(bump)
+
+
+    def _conferenceQueryCacheKey(self, request):
+        """Return the memcache key for a queryConferences request."""
+        inequality_filter, filters = self._formatFilters(request.filters,
+            multipleInequalities=True)
+        # sort the normalized filters, so that equivalent filters in a
+        # different order share a cache entry
+        normalized = sorted([filtr["field"], filtr["operator"], filtr["value"]]
+            for filtr in filters)
+        digest = hashlib.sha1(json.dumps([normalized, request.pageSize,
+            request.pageToken, request.fieldMask])).hexdigest()
+        return MEMCACHE_CONFERENCE_QUERY_TPL % (
+            self._getConferenceGeneration(), digest)
+
+
     # Get list of all Conferences    
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) 
-                for conf in conferences]
+        """Query for conferences, one page at a time if pageSize is given;
+        a fieldMask limits the ConferenceForm fields returned."""
+        fields = self._parseFieldMask(request.fieldMask, ConferenceForm)
+        # serve repeated filter combinations from memcache
+        cache_key = self._conferenceQueryCacheKey(request)
+        cached = memcache.get(cache_key)
+        if cached:
+            return protojson.decode_message(ConferenceForms, cached)
+
+        # when the planner chose between inequalities, the page token
+        # starts with its choice, so that the statistics changing between
+        # pages can't pair the cursor with a different query
+        chosen, _, token = (request.pageToken or '').rpartition(':')
+        q, residual, chosen = self._getQuery(request, chosen or None)
+        cursor = self._getPageCursor(request, token)
+
+        # fetch the results exactly once; page through them with a
+        # datastore cursor if the client asked for a page size
+        next_token = None
+        try:
+            if residual:
+                # inequalities the datastore couldn't take are applied
+                # while streaming the results, so these are always paginated
+                conferences, next_token = self._scanConferences(q, residual,
+                    request.pageSize or MAX_PAGE_SIZE, cursor)
+                if next_token:
+                    next_token = '%s:%s' % (chosen, next_token)
+            else:
+                # read only the masked fields if the index has them all
+                inequality_filter, filters = self._formatFilters(
+                    request.filters, multipleInequalities=True)
+                projection = self._projectionFor(Conference, fields,
+                    [filtr["field"] for filtr in filters
+                     if filtr["operator"] == "="])
+                conferences, next_cursor, more = self._fetchPage(q,
+                    request.pageSize, cursor, projection)
+                if more and next_cursor:
+                    next_token = next_cursor.urlsafe()
+        except datastore_errors.BadRequestError:
+            # a token from another query's results
+            if not request.pageToken:
+                raise
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+        # return individual ConferenceForm object per Conference;
+        # organizerDisplayName is stored on the Conference itself
+        copier = self._conferenceCopier(fields)
+        forms = ConferenceForms(
+            items=[copier(conf) for conf in conferences],
+            nextPageToken=next_token
         )
+        memcache.set(cache_key, protojson.encode_message(forms),
+            time=CONFERENCE_QUERY_CACHE_TTL)
+        return forms
 
 
 # - - - Session objects - - - - - - - - - - - - - - - - - - -
 
-    def _createSessionObject(self, request):
-        """Create a Session object."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        if not request.name:
+    def _sessionDataFromForm(self, form):
+        """Check a SessionForm and return its fields as a dict of Session
+        property values."""
+        if not form.name:
             raise endpoints.BadRequestException("Session 'name' field required")
 
-        # Make sure a websafeConferenceKey is provided (for testing)
-        if not request.websafeConferenceKey:
-            raise endpoints.BadRequestException("Session 'websafeConferenceKey' \
-                field required. Use form filters to add websafeConferenceKey")
-
-        # get key of conference to create sessions for
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        # check that conference exists
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-
-        # check that user is owner
-        if user_id != conf.organizerUserId:
-            raise endpoints.ForbiddenException(
-                'Only the owner can update the conference.')
-
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        data = {field.name: getattr(form, field.name) for field in form.all_fields()}
         # check that startTime is provided
         if not data['startTime']:
             raise endpoints.BadRequestException("Start time is required")
@@ -401,63 +934,267 @@ class ConferenceApi(remote.Service):
         else:
             data['date']= datetime.strptime(data['date'], '%Y-%m-%d').date()
 
-        wsck = data['websafeConferenceKey']
-        p_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        # the conference is the session's parent, not a property
+        del data['websafeConferenceKey']
+        return data
+
+
+    def _getOwnedConference(self, websafeConferenceKey):
+        """Return the Conference for websafeConferenceKey, checking that it
+        exists and that the current user organizes it."""
+        user = self._auth.requireUser()
+        user_id = self._auth.userId
+
+        # get conference to create sessions for
+        conf = self._getConference(websafeConferenceKey)
+
+        # check that user is owner
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can update the conference.')
+        return conf
+
+
+    def _createSessionObject(self, request):
+        """Create a Session object."""
+        # preload necessary data items
+        user = self._auth.requireUser()
+
+        if not request.name:
+            raise endpoints.BadRequestException("Session 'name' field required")
+
+        # Make sure a websafeConferenceKey is provided (for testing)
+        if not request.websafeConferenceKey:
+            raise endpoints.BadRequestException("Session 'websafeConferenceKey' \
+                field required. Use form filters to add websafeConferenceKey")
+
+        conf = self._getOwnedConference(request.websafeConferenceKey)
+        data = self._sessionDataFromForm(request)
+
+        p_key = conf.key
         
-        c_id = Session.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Session, c_id, parent=p_key)
+        c_key = SESSION_IDS.allocateKey(parent=p_key)
       
         data['key'] = c_key
 
-        Session(**data).put()
+        session = Session(**data)
+        self._putSessions(p_key, [session])
         
         # get speaker name
         newSessionSpeaker = data['speaker']
-        
-        # Push task to determine if speaker of this new 
-        # session should be set as the featured speaker
-        taskqueue.add(params={'newSessionSpeaker': newSessionSpeaker,
-            'websafeConferenceKey': wsck},
-            url='/tasks/set_featured_speaker'
+
+        # index the session under its speaker for getSessionsBySpeaker
+        if newSessionSpeaker:
+            self._addSessionsToSpeaker(newSessionSpeaker, [c_key])
+
+            # Push task to determine if speaker of this new 
+            # session should be set as the featured speaker
+            taskqueue.add(params={'websafeSessionKey': c_key.urlsafe()},
+                url='/tasks/set_featured_speaker'
+            )
+        return self._copySessionToForm(session)
+
+
+    def _createSessionObjects(self, request):
+        """Create the Sessions in a SessionForms for one conference."""
+        if not request.items:
+            raise endpoints.BadRequestException("No sessions given.")
+        if len(request.items) > MAX_SESSIONS_PER_REQUEST:
+            raise endpoints.BadRequestException(
+                "At most %d sessions can be created at once." %
+                MAX_SESSIONS_PER_REQUEST)
+
+        # check the conference and its owner once for all sessions
+        conf = self._getOwnedConference(request.websafeConferenceKey)
+
+        # validate everything before allocating ids or writing
+        all_data = [self._sessionDataFromForm(form) for form in request.items]
+
+        # one allocation for the whole batch
+        first, last = Session.allocate_ids(size=len(all_data), parent=conf.key)
+        sessions = []
+        for s_id, data in zip(range(first, last + 1), all_data):
+            data['key'] = ndb.Key(Session, s_id, parent=conf.key)
+            sessions.append(Session(**data))
+        self._putSessions(conf.key, sessions)
+
+        # index the sessions by speaker, one write per speaker
+        by_speaker = {}
+        for session in sessions:
+            if session.speaker:
+                by_speaker.setdefault(session.speaker, []).append(session)
+        tasks = []
+        for speaker, speaker_sessions in by_speaker.items():
+            self._addSessionsToSpeaker(speaker,
+                [session.key for session in speaker_sessions])
+            # one featured speaker task per speaker, covering all of
+            # the speaker's new sessions
+            tasks.append(taskqueue.Task(params={
+                'websafeSessionKey': [session.key.urlsafe()
+                    for session in speaker_sessions]},
+                url='/tasks/set_featured_speaker'))
+        # the task queue accepts at most 100 tasks per call
+        for i in range(0, len(tasks), 100):
+            taskqueue.Queue().add(tasks[i:i + 100])
+
+        return SessionForms(
+            items=[self._copySessionToForm(session) for session in sessions]
         )
-        return self._copySessionToForm(request)
+
+
+    @staticmethod
+    def _sessionsVersionKey(c_key):
+        """Return the key of a conference's SessionsVersion."""
+        return ndb.Key(SessionsVersion, 1, parent=c_key)
+
+
+    @staticmethod
+    def _sessionTypeIndexKey(c_key):
+        """Return the key of a conference's SessionTypeIndex."""
+        return ndb.Key(SessionTypeIndex, 1, parent=c_key)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _putSessions(c_key, sessions):
+        """Write a conference's new sessions together with a new version
+        of its sessions and their entries in its type index. All are in
+        the conference's entity group, so they are written in one
+        transaction: no version or index can miss a session that was saved."""
+        ConferenceApi._checkNotMoving(c_key)
+        v_key = ConferenceApi._sessionsVersionKey(c_key)
+        sv, index = ndb.get_multi(
+            [v_key, ConferenceApi._sessionTypeIndexKey(c_key)])
+        sv = sv or SessionsVersion(key=v_key)
+        sv.version += 1
+        entities = list(sessions) + [sv]
+        # an index that doesn't exist yet is built in full when first read
+        if index:
+            ConferenceApi._indexSessionTypes(index, sessions)
+            entities.append(index)
+        ndb.put_multi(entities)
+
+
+    @staticmethod
+    def _indexSessionTypes(index, sessions):
+        """Add sessions to the buckets of a SessionTypeIndex, replacing any
+        earlier entries for them."""
+        s_ids = set(session.key.id() for session in sessions)
+        types = {}
+        for type_, entries in (index.types or {}).items():
+            entries = [entry for entry in entries if entry[1] not in s_ids]
+            if entries:
+                types[type_] = entries
+        for session in sessions:
+            # str() of dates & times sorts in time order
+            when = '%s %s' % (session.date or '', session.startTime or '')
+            for type_ in set(session.typeOfSession):
+                types.setdefault(type_, []).append([when, session.key.id()])
+        for entries in types.values():
+            entries.sort()
+        index.types = types
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _buildSessionTypeIndex(c_key):
+        """Return a conference's SessionTypeIndex, indexing all of its
+        sessions if it doesn't exist yet. The ancestor query is in the
+        entity group, so sessions written meanwhile make the transaction
+        retry rather than be missed."""
+        t_key = ConferenceApi._sessionTypeIndexKey(c_key)
+        index = t_key.get()
+        if not index:
+            index = SessionTypeIndex(key=t_key, types={})
+            ConferenceApi._indexSessionTypes(index,
+                Session.query(ancestor=c_key).fetch())
+            index.put()
+        return index
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _addSessionsToConferenceSpeaker(c_key, speaker, sessions):
+        """Count (session key, session name) pairs towards a speaker's
+        sessions in a conference; returns the updated ConferenceSpeaker.
+        Sessions already counted are skipped, so retried tasks are harmless.
+        """
+        cs_key = ndb.Key(ConferenceSpeaker,
+            ConferenceApi._speakerKey(speaker).id(), parent=c_key)
+        cs = cs_key.get() or ConferenceSpeaker(key=cs_key, speaker=speaker)
+        new_sessions = [(s_key, name) for s_key, name in sessions
+            if s_key not in cs.sessionKeys]
+        if new_sessions:
+            for s_key, name in new_sessions:
+                cs.sessionKeys.append(s_key)
+                cs.sessionNames.append(name)
+            cs.numSessions = len(cs.sessionKeys)
+            cs.put()
+        return cs
+
+
+    @staticmethod
+    def _setFeaturedSpeaker(cs):
+        """Set a ConferenceSpeaker as its conference's Featured Speaker in
+        memcache; returns the announcement."""
+        speakerNameAndSessions = FEATURED_SPEAKER_TPL.format(
+            cs.speaker, ", ".join(cs.sessionNames))
+        memcache.set(MEMCACHE_FEATURED_SPEAKER_TPL % cs.key.parent().urlsafe(),
+            speakerNameAndSessions)
+        return speakerNameAndSessions
+
+
+    @staticmethod
+    def _featureSpeakers(sessions):
+        """Count new sessions towards their speakers in their conferences,
+        and feature each speaker that now has more than one session."""
+        by_speaker = {}
+        for session in sessions:
+            if session.speaker:
+                by_speaker.setdefault((session.key.parent(), session.speaker),
+                    []).append((session.key, session.name))
+        for (c_key, speaker), speaker_sessions in by_speaker.items():
+            cs = ConferenceApi._addSessionsToConferenceSpeaker(c_key, speaker,
+                speaker_sessions)
+            if cs.numSessions > 1:
+                ConferenceApi._setFeaturedSpeaker(cs)
 
 
     # Use Push Task to determine featured speaker, a speaker that has 
     # more than 1 session in a conference 
     @staticmethod
-    def _cacheFeaturedSpeaker(newSessionSpeaker, websafeConferenceKey):
+    def _cacheFeaturedSpeaker(websafeSessionKeys):
         """Called when a new session is created and evaluates whether the 
         speaker of the new session should be set as the featured speaker 
-        for the conference.
+        for the conference. Updates the speaker's session count in the
+        conference, so the work doesn't depend on how many sessions exist.
+        The speaker, conference and names are read from the saved sessions,
+        not taken from the request.
         """     
-        
-        # get all sessions in this conference by this speaker 
-        sessions = Session.query(Session.websafeConferenceKey == websafeConferenceKey)\
-        .filter(Session.speaker == newSessionSpeaker)
-        
-        count = sessions.count()
-        
-        if count > 1:
-            separator = ", "
-            thisSpeakersSessions = separator.join([session.name \
-                for session in sessions])
-                
-            # speakerNameAndSessions = "Featured Speaker is "+newSessionSpeaker+\
-            # " presenting sessions: "+thisSpeakersSessions
-            speakerNameAndSessions = "Featured Speaker is {} presenting sessions: {}"\
-            .format(newSessionSpeaker, thisSpeakersSessions)
-
-            memcache.set(MEMCACHE_FEATURED_SPEAKERS_KEY, speakerNameAndSessions)
-
-
-    # Get Featured Speaker from Memcache
-    @endpoints.method(message_types.VoidMessage, StringMessage, 
-        path="featuredSpeaker", 
+        s_keys = [ndb.Key(urlsafe=wssk) for wssk in websafeSessionKeys]
+        sessions = ndb.get_multi([s_key for s_key in s_keys
+            if s_key.kind() == Session._get_kind()])
+        ConferenceApi._featureSpeakers(
+            [session for session in sessions if session])
+
+
+    # Get Featured Speaker of a Conference from Memcache
+    @endpoints.method(CONF_GET_REQUEST, StringMessage, 
+        path="conference/{websafeConferenceKey}/featuredSpeaker", 
        http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Get Featured Speaker from Memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_FEATURED_SPEAKERS_KEY) or "")
+        """Get Featured Speaker of a Conference from Memcache."""
+        featured = memcache.get(
+            MEMCACHE_FEATURED_SPEAKER_TPL % request.websafeConferenceKey)
+        if featured is None:
+            # not cached; fall back to the speaker with the most sessions
+            c_key = self._getConference(request.websafeConferenceKey).key
+            cs = ConferenceSpeaker.query(ancestor=c_key).order(
+                -ConferenceSpeaker.numSessions).get()
+            featured = ""
+            if cs and cs.numSessions > 1:
+                featured = self._setFeaturedSpeaker(cs)
+        return StringMessage(data=featured)
 
     
     # Create a new Session
@@ -468,6 +1205,15 @@ class ConferenceApi(remote.Service):
         return self._createSessionObject(request)
 
     
+    # Create several Sessions in a Conference
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms,
+        path='conference/{websafeConferenceKey}/sessions',
+        http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create new sessions for a conference in one batch."""
+        return self._createSessionObjects(request)
+
+
     # Get Sessions for a Conference
     @endpoints.method(SESSION_CONTAINER, SessionForms, 
         path='getConferenceSessions/{websafeConferenceKey}',
@@ -476,40 +1222,56 @@ class ConferenceApi(remote.Service):
     def getConferenceSessions(self, request):
         '''Given a conference, return all sessions'''
         # make sure user is logged in
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        
-        # get conference key to use to find all sessions in this conference
-        conferenceKey = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        ck = getattr(conferenceKey, "key")
-        
+        user = self._auth.requireUser()
+
+        ck, version = self._getSessionsVersion(request.websafeConferenceKey)
+        return self._conferenceSessionForms(ck, version, request.fieldMask)
+
+
+    def _getSessionsVersion(self, websafeConferenceKey):
+        '''Return the key of a conference, following a move, and the version
+        of its sessions; raise NotFoundException if there is no conference.
+        Both come from memcache through ndb, so checking an unchanged
+        listing doesn't reach the datastore'''
+        ck = ndb.Key(urlsafe=websafeConferenceKey)
+        conf, sv = ndb.get_multi([ck, self._sessionsVersionKey(ck)])
+        if not conf:
+            ck = self._getConference(websafeConferenceKey).key
+            sv = self._sessionsVersionKey(ck).get()
+        return ck, sv.version if sv else 0
+
+
+    def _conferenceSessionForms(self, ck, version, fieldMask):
+        '''Return the sessions of a conference, and their version, as
+        SessionForms'''
         # get all sessions in this conference
-        sessions = Session.query(Session.websafeConferenceKey == request.websafeConferenceKey)
-        
+        fields = self._parseFieldMask(fieldMask, SessionForm)
+        sessions = self._fetchSessions(Session.query(ancestor=ck), fields)
+
         # return sessions in this conference
+        copier = self._sessionCopier(fields)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[copier(session) for session in sessions],
+            version=version
         )
 
+
+    def _fetchSessions(self, q, fields):
+        """Return the Sessions a query finds. With a field mask they are
+        projected from the index; otherwise only their keys are queried
+        and the entities are read through ndb's caches."""
+        projection = self._projectionFor(Session, fields)
+        if projection:
+            sessions, _, _ = self._fetchPage(q, projection=projection)
+            return sessions
+        # a session deleted since the query ran comes back as None
+        return [session for session in ndb.get_multi(q.fetch(keys_only=True))
+            if session]
+
     
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                # convert Date to date string; just copy others
-                # For converted fields, only do operation if not null # TODO
-                if field.name == 'date':
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                elif field.name == 'startTime':
-                    setattr(sf, field.name, str(getattr(sess, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))        
-            elif field.name == "websafeConferenceKey":
-                setattr(sf, field.name, sess.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return copySessionToForm(sess)
 
  
     def _getQuerySession(self, request):
@@ -544,25 +1306,86 @@ class ConferenceApi(remote.Service):
         '''Given a conference, return all sessions of a specified type'''
         
         # make sure user is logged in
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        # get conference key to use to find all sessions in this conference
-        conferenceKey = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        ck = getattr(conferenceKey, "key")
-        
-        # create ancestor query to get all sessions in this conference
-        sessions = Session.query(Session.websafeConferenceKey == request.websafeConferenceKey)
-        sessions = sessions.filter(Session.typeOfSession.IN(request.typeOfSession))
+        user = self._auth.requireUser()
+        user_id = self._auth.userId
+
+        # the conference and its type index come from memcache through ndb
+        ck = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf, index = ndb.get_multi([ck, self._sessionTypeIndexKey(ck)])
+        if not conf:
+            # follow a moved conference, or raise NotFoundException
+            ck = self._getConference(request.websafeConferenceKey).key
+            index = self._sessionTypeIndexKey(ck).get()
+        index = index or self._buildSessionTypeIndex(ck)
+
+        # merge the buckets of the requested types in time order; a
+        # session of several of the types is listed once
+        entries = sorted(set(tuple(entry)
+            for type_ in set(request.typeOfSession)
+            for entry in index.types.get(type_, [])))
+        sessions = ndb.get_multi([ndb.Key(Session, s_id, parent=ck)
+            for _, s_id in entries])
+        fields = self._parseFieldMask(request.fieldMask, SessionForm)
 
         # return sessions in this conference
+        copier = self._sessionCopier(fields)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[copier(session) for session in sessions if session]
         )
 
 
+    @staticmethod
+    def _speakerKey(speaker):
+        """Return the Speaker index key for a speaker name; names that only
+        differ in case or whitespace share a key."""
+        return ndb.Key(Speaker, ' '.join(speaker.split()).lower())
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _addSessionsToSpeaker(speaker, session_keys):
+        """Add session keys to a speaker's index entry, creating it if needed."""
+        s_key = ConferenceApi._speakerKey(speaker)
+        spkr = s_key.get() or Speaker(key=s_key, name=speaker)
+        new_keys = [k for k in session_keys if k not in spkr.sessionKeys]
+        if new_keys:
+            spkr.sessionKeys.extend(new_keys)
+            spkr.put()
+
+
+    # Use Push Task to index existing sessions by speaker, one batch per task
+    @staticmethod
+    def _backfillSpeakerIndex(websafeCursor=None):
+        """Add a batch of sessions to the Speaker index and the conference
+        speaker counts, and queue a task for the next batch, if there is one."""
+        sessions, cursor, more = Session.query().fetch_page(
+            SPEAKER_BACKFILL_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor or None))
+
+        # group the batch by speaker (and conference) so each index entry
+        # is written once
+        by_speaker = {}
+        by_conference_speaker = {}
+        for session in sessions:
+            if not session.speaker:
+                continue
+            s_id = ConferenceApi._speakerKey(session.speaker).id()
+            by_speaker.setdefault(s_id, (session.speaker, []))[1].append(
+                session.key)
+            by_conference_speaker.setdefault(
+                (session.key.parent(), s_id), (session.speaker, []))[1].append(
+                (session.key, session.name))
+        for speaker, session_keys in by_speaker.values():
+            ConferenceApi._addSessionsToSpeaker(speaker, session_keys)
+        for (c_key, s_id), (speaker, pairs) in by_conference_speaker.items():
+            ConferenceApi._addSessionsToConferenceSpeaker(c_key, speaker, pairs)
+
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                url='/tasks/backfill_speaker_index'
+            )
+
+
     # Get Sessions by Speaker
     @endpoints.method(SPEAKER_CONTAINER, SessionForms,
         path='getSessionsBySpeaker/{speaker}',
@@ -572,32 +1395,20 @@ class ConferenceApi(remote.Service):
         '''Given a speaker, return all sessions given by this particular speaker, across all conferences'''
         
         # make sure user is logged in
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user = self._auth.requireUser()
+        user_id = self._auth.userId
 
-        # get speaker value from form request
-        sessionSpeakerOfInterest = request.speaker
-        
-        # store all session objects across all conferences where this speaker is presenting
-        all_sessions = []
-        # query for conferences
-        conferences = Conference.query()
-        for conf in conferences:
-            ck = getattr(conf, 'key')
-            wsck = ck.urlsafe()
-            
-            # For each conference, get Sessions for the Conference filtered by Speaker
-            sessions = Session.query(Session.websafeConferenceKey == wsck)
-            sessions = sessions.filter(Session.speaker == sessionSpeakerOfInterest)
-            
-            for session in sessions:
-                all_sessions.append(session)
+        # look up the speaker's sessions in the Speaker index
+        if not request.speaker:
+            raise endpoints.BadRequestException("Speaker is required.")
+        fields = self._parseFieldMask(request.fieldMask, SessionForm)
+        spkr = self._speakerKey(request.speaker).get()
+        sessions = ndb.get_multi(spkr.sessionKeys) if spkr else []
 
         # return sessions in all conferences
+        copier = self._sessionCopier(fields)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in all_sessions]
+            items=[copier(session) for session in sessions if session]
         )
 
 
@@ -611,35 +1422,41 @@ class ConferenceApi(remote.Service):
         
         # check if session exists given sessionKey
         # get session; check that it exists
-        session_key = request.sessionKey
+        session_key = ndb.Key(urlsafe=request.sessionKey)
         
-        session = ndb.Key(urlsafe=session_key).get()
+        session = session_key.get()
         
         if not session:
-            raise endpoints.NotFoundException('No session found with key: %s' % session_key)
+            raise endpoints.NotFoundException('No session found with key: %s' % request.sessionKey)
+
+        # legacy websafe keys are folded in on the first change
+        wishlist = wishlistKeys(prof)
    
         # add session to wishlist
         if reg:
             # check if user already registered otherwise add
-            if session_key in prof.sessionKeysForWishlist:
+            if session_key in wishlist:
                 raise ConflictException("You have already added this session to your wishlist")
             # add session to wishlist
-            prof.sessionKeysForWishlist.append(session_key)
+            wishlist.append(session_key)
             retval = True
 
         # remove session from wishlist
         else:
             # check if session already in wishlist
-            if session_key in prof.sessionKeysForWishlist:
+            if session_key in wishlist:
         
                 # remove session from wishlist
-                prof.sessionKeysForWishlist.remove(session_key)
+                wishlist.remove(session_key)
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
+        prof.sessionKeysForWishlist = wishlist
+        prof.legacySessionKeysForWishlist = []
         prof.put()
+        self._cacheProfile(prof)
         return BooleanMessage(data=retval)
 
 
@@ -662,26 +1479,26 @@ class ConferenceApi(remote.Service):
 
 
     # Get list of Sessions in Wishlist
-    @endpoints.method(message_types.VoidMessage, SessionForms, 
+    @endpoints.method(FIELDS_REQUEST, SessionForms, 
         path='sessions/wishlist',
         http_method="GET", name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
         """Get list of sessions in wishlist."""
+        fields = self._parseFieldMask(request.fieldMask, SessionForm)
         prof = self._getProfileFromUser() # get user Profile
         
-        session_keys = [ndb.Key(urlsafe=wsck) for wsck 
-        in prof.sessionKeysForWishlist]
+        sessions = ndb.get_multi(wishlistKeys(prof))
         
-        sessions = ndb.get_multi(session_keys)
-        
-        # return set of SessionForm objects per Session
+        # return set of SessionForm objects per Session; sessions deleted
+        # since they were added are skipped
+        copier = self._sessionCopier(fields)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[copier(session) for session in sessions if session]
         )    
     
     
     # Get sessions that are 30 min in length
-    @endpoints.method(message_types.VoidMessage, SessionForms, 
+    @endpoints.method(FIELDS_REQUEST, SessionForms, 
         path='sessions/shortSessions',
         http_method="GET", name='getShortSessions')
     def getShortSessions(self, request):
@@ -690,15 +1507,19 @@ class ConferenceApi(remote.Service):
         
         sessionLength = 30
         sessions = Session.query(Session.duration <= sessionLength).filter(Session.duration != None)
+        fields = self._parseFieldMask(request.fieldMask, SessionForm)
+        sessions, _, _ = self._fetchPage(sessions,
+            projection=self._projectionFor(Session, fields))
         
         # return set of SessionForm objects per Session
+        copier = self._sessionCopier(fields)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[copier(session) for session in sessions]
         )  
 
     
     # Get conferences that contain Android in the name
-    @endpoints.method(message_types.VoidMessage, ConferenceForms, 
+    @endpoints.method(FIELDS_REQUEST, ConferenceForms, 
         path='conferences/keyword',
         http_method="GET", name='getConferencesByKeyword')
     def getConferencesByKeyword(self, request):
@@ -709,16 +1530,19 @@ class ConferenceApi(remote.Service):
         # TODO: Use ComputedProperty to make query case insenstive
         # https://cloud.google.com/appengine/docs/python/ndb/properties#computed
         keyword = 'Android'
-        conferences = Conference.query(Conference.name == keyword)
+        fields = self._parseFieldMask(request.fieldMask, ConferenceForm)
+        conferences, _, _ = self._fetchPage(
+            Conference.query(Conference.name == keyword),
+            projection=self._projectionFor(Conference, fields, ['name']))
         
         # return set of ConferenceForm objects
+        copier = self._conferenceCopier(fields)
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf 
-            in conferences]
+            items=[copier(conf) for conf in conferences]
         )
 
     # Get conferences that mid-day
-    @endpoints.method(message_types.VoidMessage, SessionForms, 
+    @endpoints.method(FIELDS_REQUEST, SessionForms, 
         path='sessions/midday',
         http_method="GET", name='getMiddaySessions')
     def getMiddaySessions(self, request):
@@ -733,15 +1557,19 @@ class ConferenceApi(remote.Service):
         midday_sessions = Session.query(Session.startTime >= morningCutoffTime and \
             Session.startTime <= afternoonCutoff)
 
+        fields = self._parseFieldMask(request.fieldMask, SessionForm)
+        midday_sessions, _, _ = self._fetchPage(midday_sessions,
+            projection=self._projectionFor(Session, fields))
+
         # return set of SessionForm objects
+        copier = self._sessionCopier(fields)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session 
-            in midday_sessions]
+            items=[copier(session) for session in midday_sessions]
         ) 
     
     
     # Get sessions that start before 7:00pm and are not workshops
-    @endpoints.method(message_types.VoidMessage, SessionForms, 
+    @endpoints.method(FIELDS_REQUEST, SessionForms, 
         path='sessions/getMySessionsOfInterest',
         http_method="GET", name='getMySessionsOfInterest')
     def getMySessionsOfInterest(self, request):
@@ -763,9 +1591,10 @@ class ConferenceApi(remote.Service):
                 mySessionsOfInterest.append(session)
         
         # return set of SessionForm objects per Session
+        copier = self._sessionCopier(
+            self._parseFieldMask(request.fieldMask, SessionForm))
         return SessionForms(
-            items=[self._copySessionToForm(session) for session 
-            in mySessionsOfInterest]
+            items=[copier(session) for session in mySessionsOfInterest]
         )  
 
 
@@ -774,31 +1603,32 @@ class ConferenceApi(remote.Service):
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
         # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, 
-                        getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+        pf = copyProfileToForm(prof)
+        # registrations are kept in Registration entities under the Profile
+        self._foldLegacyRegistrations(prof)
+        pf.conferenceKeysToAttend = [reg.conference.urlsafe() for reg in
+            Registration.query(ancestor=prof.key)]
         return pf
 
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one if non-existent."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        user = self._auth.requireUser()
 
-        # get Profile from datastore
-        user_id = getUserId(user)
+        # get Profile from the instance cache, or the datastore; the cache
+        # may be a minute stale, so anything that writes the Profile reads
+        # it in a transaction, which always goes to the datastore
+        user_id = self._auth.userId
         p_key = ndb.Key(Profile, user_id)
+        if not ndb.in_transaction():
+            values = PROFILES.get(user_id)
+            if values is not None:
+                return Profile(key=p_key, **copy.deepcopy(values))
         profile = p_key.get()
-        # create new Profile if not there
+        # create new Profile if not there; outside a transaction the write
+        # doesn't hold up the user's first request, and the API waits for
+        # it (ndb.toplevel)
         if not profile:
             profile = Profile(
                 key = p_key,
@@ -806,28 +1636,65 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            if ndb.in_transaction():
+                profile.put()
+            else:
+                profile.put_async()
 
+        self._cacheProfile(profile)
         return profile
 
 
-    def _doProfile(self, save_request=None):
-        """Get user Profile and return to user, possibly updating it first."""
-        # get user Profile
+    @staticmethod
+    def _cacheProfile(prof):
+        """Write a Profile through to the instance cache, once the current
+        transaction (if any) has committed."""
+        values = copy.deepcopy(prof.to_dict())
+        ndb.get_context().call_on_commit(
+            lambda: PROFILES.set(prof.key.id(), values))
+
+
+    @ndb.transactional()
+    def _saveProfile(self, save_request):
+        """Apply the user-modifyable fields of save_request to the user's
+        Profile, read fresh in the transaction rather than from the cache;
+        returns the Profile and the names of the fields that changed."""
         prof = self._getProfileFromUser()
 
+        # track the fields that actually change
+        changed = set()
+        for field in ('displayName', 'teeShirtSize'):
+            if hasattr(save_request, field):
+                val = getattr(save_request, field)
+                if val and getattr(prof, field) != str(val):
+                    setattr(prof, field, str(val))
+                    changed.add(field)
+                    #if field == 'teeShirtSize':
+                    #    setattr(prof, field, str(val).upper())
+                    #else:
+                    #    setattr(prof, field, val)
+
+        # write at most once, and not at all if nothing changed
+        if changed:
+            prof.put()
+            self._cacheProfile(prof)
+        return prof, changed
+
+
+    def _doProfile(self, save_request=None):
+        """Get user Profile and return to user, possibly updating it first."""
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        #else:
-                        #    setattr(prof, field, val)
-                        prof.put()
+            prof, changed = self._saveProfile(save_request)
+
+            # copy a new displayName onto the conferences this user organizes
+            if 'displayName' in changed:
+                taskqueue.add(params={'organizerUserId': prof.key.id()},
+                    url='/tasks/update_organizer_display_name'
+                )
+        else:
+            # read only, so the cached Profile will do
+            prof = self._getProfileFromUser()
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -849,44 +1716,244 @@ class ConferenceApi(remote.Service):
         return self._doProfile(request)
 
 
+    # Use Push Task to copy an organizer's displayName onto their
+    # conferences, one batch per task
+    @staticmethod
+    def _updateOrganizerDisplayName(organizerUserId, websafeCursor=None):
+        """Set organizerDisplayName on a batch of the organizer's conferences
+        and queue a task for the next batch, if there is one.
+        """
+        p_key = ndb.Key(Profile, organizerUserId)
+        prof = p_key.get()
+        if not prof:
+            return
+
+        # by organizer rather than ancestor, to include root conferences
+        confs, cursor, more = Conference.query(
+            Conference.organizerUserId == organizerUserId).fetch_page(
+            ORGANIZER_FANOUT_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor or None))
+
+        # only write conferences that are out of date
+        stale = [conf for conf in confs
+            if conf.organizerDisplayName != prof.displayName]
+        for conf in stale:
+            conf.organizerDisplayName = prof.displayName
+        if stale:
+            ndb.put_multi(stale)
+            ConferenceApi._bumpConferenceGeneration()
+
+        if more and cursor:
+            taskqueue.add(params={'organizerUserId': organizerUserId,
+                'cursor': cursor.urlsafe()},
+                url='/tasks/update_organizer_display_name'
+            )
+
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+    def _isNearlySoldOut(seatsAvailable):
+        """Return True if a conference with seatsAvailable left should be
+        announced."""
+        return 0 < (seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS
+
 
-        if confs:
+    @staticmethod
+    def _setAnnouncement(nearlySoldOut):
+        """Format the Announcement for a NearlySoldOut & assign to memcache."""
+        if nearlySoldOut and nearlySoldOut.conferences:
             # If there are almost sold out conferences,
             # format announcement and set it in memcache
             announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
+                ', '.join(sorted(nearlySoldOut.conferences.values())))
             memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         else:
             # If there are no sold out conferences,
             # delete the memcache announcements entry
             announcement = ""
             memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
         return announcement
 
 
+    @staticmethod
+    @ndb.transactional()
+    def _updateNearlySoldOut(conf):
+        """Add conf to or remove it from the nearly sold out conferences,
+        whichever its seatsAvailable calls for, and refresh the
+        Announcement once the change is committed."""
+        nso = NEARLY_SOLD_OUT_KEY.get() or NearlySoldOut(
+            key=NEARLY_SOLD_OUT_KEY, conferences={})
+        wsck = conf.key.urlsafe()
+        if ConferenceApi._isNearlySoldOut(conf.seatsAvailable):
+            if nso.conferences.get(wsck) == conf.name:
+                return
+            nso.conferences[wsck] = conf.name
+        else:
+            if wsck not in nso.conferences:
+                return
+            del nso.conferences[wsck]
+        nso.put()
+        ndb.get_context().call_on_commit(
+            lambda: ConferenceApi._setAnnouncement(nso))
+
+
+    @staticmethod
+    def _cacheAnnouncement():
+        """Rebuild the nearly sold out conferences from a query, create
+        Announcement & assign to memcache; used by the reconciliation
+        cron job, registrations keep it current in between.
+        """
+        confs = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch(projection=[Conference.name])
+
+        nso = NearlySoldOut(key=NEARLY_SOLD_OUT_KEY,
+            conferences=dict((conf.key.urlsafe(), conf.name) for conf in confs))
+        nso.put()
+        return ConferenceApi._setAnnouncement(nso)
+
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if announcement is None:
+            # evicted or never set; rebuild it from the datastore copy
+            announcement = self._setAnnouncement(NEARLY_SOLD_OUT_KEY.get())
+        return StringMessage(data=announcement)
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _seatShardKeys(conf):
+        """Return the keys of a Conference's SeatShards."""
+        wsck = conf.key.urlsafe()
+        return [ndb.Key(SeatShard, '%s:%d' % (wsck, i))
+            for i in range(conf.seatShards)]
+
+
+    @staticmethod
+    def _makeSeatShards(conf):
+        """Return new SeatShards splitting conf.seatsAvailable evenly."""
+        share, extra = divmod(conf.seatsAvailable or 0, conf.seatShards)
+        return [SeatShard(key=s_key, seatsAvailable=share + (i < extra))
+            for i, s_key in enumerate(ConferenceApi._seatShardKeys(conf))]
+
+
+    @staticmethod
     @ndb.transactional(xg=True)
+    def _shardSeats(c_key):
+        """Move the seats of a Conference created before seat sharding
+        into SeatShards; returns the updated Conference."""
+        conf = c_key.get()
+        if not conf.seatShards:
+            ConferenceApi._checkNotMoving(c_key)
+            conf.seatShards = NUM_SEAT_SHARDS
+            ndb.put_multi([conf] + ConferenceApi._makeSeatShards(conf))
+        return conf
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _resizeSeats(c_key, maxAttendees):
+        """Change a Conference's maxAttendees, adding the difference to
+        its SeatShards or taking it from their free seats; returns the
+        updated Conference."""
+        ConferenceApi._checkNotMoving(c_key)
+        conf = c_key.get()
+        shard_keys = ConferenceApi._seatShardKeys(conf)
+        shards = [shard or SeatShard(key=s_key, seatsAvailable=0)
+            for s_key, shard in zip(shard_keys, ndb.get_multi(shard_keys))]
+        delta = maxAttendees - (conf.maxAttendees or 0)
+        if delta >= 0:
+            share, extra = divmod(delta, len(shards))
+            for i, shard in enumerate(shards):
+                shard.seatsAvailable += share + (i < extra)
+        else:
+            if sum(shard.seatsAvailable for shard in shards) < -delta:
+                raise ConflictException(
+                    "More attendees have registered than maxAttendees.")
+            # take the seats from the fullest shards first
+            for shard in sorted(shards, key=lambda shard: -shard.seatsAvailable):
+                taken = min(-delta, shard.seatsAvailable)
+                shard.seatsAvailable -= taken
+                delta += taken
+        conf.maxAttendees = maxAttendees
+        conf.seatsAvailable = sum(shard.seatsAvailable for shard in shards)
+        ndb.put_multi([conf] + shards)
+        return conf
+
+
+    @ndb.transactional(xg=True)
+    def _reserveSeat(self, reg_key, c_key, shard_key):
+        """Take a seat from one shard and create the Registration for the
+        conference c_key. Returns None, without writing, if the shard has
+        run out of seats."""
+        reg, shard = ndb.get_multi([reg_key, shard_key])
+        if reg:
+            raise ConflictException(
+                "You have already registered for this conference")
+        # a move freezes the shards before copying them; checking the shard
+        # rather than the MovedConference keeps registrations for different
+        # shards out of each other's way
+        if shard and shard.frozen:
+            raise ConflictException(MOVING_CONFERENCE_MESSAGE)
+        if not shard or shard.seatsAvailable <= 0:
+            return None
+        shard.seatsAvailable -= 1
+        reg = Registration(key=reg_key, conference=c_key)
+        ndb.put_multi([reg, shard])
+        return True
+
+
+    def _takeSeat(self, reg_key, c_key, shard_keys):
+        """Reserve a seat in conference c_key from one of shard_keys for
+        reg_key; returns None if they have all run out. Shards are tried in
+        random order to spread the writes, and each attempt re-checks its
+        shard inside the transaction. A shard too contended to commit is passed over for the
+        next one; if no seat was taken and a shard failed that way, the
+        failure is raised, as there may still be seats."""
+        shards = [shard for shard in ndb.get_multi(shard_keys)
+            if shard and shard.seatsAvailable > 0]
+        random.shuffle(shards)
+        failure = None
+        for shard in shards:
+            try:
+                if self._reserveSeat(reg_key, c_key, shard.key):
+                    return True
+            except datastore_errors.TransactionFailedError as e:
+                failure = e
+        if failure:
+            raise failure
+        return None
+
+
+    @ndb.transactional(xg=True)
+    def _releaseSeat(self, reg_key, shard_key):
+        """Give a seat back to a shard and delete the Registration.
+        Returns False if the user wasn't registered."""
+        reg, shard = ndb.get_multi([reg_key, shard_key])
+        # a moving conference's Registrations may already be under its
+        # new key
+        if shard and shard.frozen:
+            raise ConflictException(MOVING_CONFERENCE_MESSAGE)
+        if not reg:
+            return False
+        if not shard:
+            # the shard may have been deleted by a finished move
+            self._checkNotMoving(reg.conference)
+            shard = SeatShard(key=shard_key)
+        shard.seatsAvailable += 1
+        shard.put()
+        reg_key.delete()
+        return True
+
+
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
@@ -894,74 +1961,479 @@ class ConferenceApi(remote.Service):
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % wsck)
+        conf = self._getConference(request.websafeConferenceKey)
+        wsck = conf.key.urlsafe()
+        if not conf.seatShards:
+            conf = self._shardSeats(conf.key)
+        shard_keys = self._seatShardKeys(conf)
+        reg_key = ndb.Key(Registration, wsck, parent=prof.key)
+        self._foldLegacyRegistrations(prof)
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if reg_key.get():
                 raise ConflictException(
                     "You have already registered for this conference")
 
+            # register user, taking a seat from a shard that still has one
+            retval = self._takeSeat(reg_key, conf.key, shard_keys)
+
             # check if seats avail
-            if conf.seatsAvailable <= 0:
+            if not retval:
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            # unregister user, add back one seat
+            retval = self._releaseSeat(reg_key, random.choice(shard_keys))
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
+        if retval:
+            self._queueSeatsAvailableUpdate(conf.key)
         return BooleanMessage(data=retval)
 
 
+    @staticmethod
+    def _queueSeatsAvailableUpdate(c_key):
+        """Queue a recount of Conference.seatsAvailable, coalescing all
+        registrations within SEATS_UPDATE_INTERVAL seconds into one task."""
+        wsck = c_key.urlsafe()
+        try:
+            taskqueue.add(
+                name='seats-%s-%d' % (wsck, time.time() // SEATS_UPDATE_INTERVAL),
+                params={'websafeConferenceKey': wsck},
+                url='/tasks/update_seats_available',
+                countdown=SEATS_UPDATE_INTERVAL
+            )
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+    # Use Push Task to copy the sum of the seat shards onto the Conference,
+    # where listings, filters and announcements read it
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _updateSeatsAvailable(websafeConferenceKey):
+        """Set Conference.seatsAvailable to the total of its SeatShards."""
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+        if not conf or not conf.seatShards:
+            return
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(conf))
+        seats = sum(shard.seatsAvailable for shard in shards if shard)
+        if conf.seatsAvailable != seats:
+            crossed = (ConferenceApi._isNearlySoldOut(conf.seatsAvailable) !=
+                ConferenceApi._isNearlySoldOut(seats))
+            conf.seatsAvailable = seats
+            conf.put()
+            ConferenceApi._bumpConferenceGeneration()
+            # keep the announcement current when a conference becomes, or
+            # stops being, nearly sold out
+            if crossed:
+                ConferenceApi._updateNearlySoldOut(conf)
+
+
     # Get conferences you are registered for
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(PAGE_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
+        fields = self._parseFieldMask(request.fieldMask, ConferenceForm)
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        
-        conferences = ndb.get_multi(conf_keys)
+        cursor = self._getPageCursor(request)
+        self._foldLegacyRegistrations(prof)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        
-        profiles = ndb.get_multi(organisers)
+        # the conferences are read from the Registrations' conference keys
+        regs, next_cursor, more = Registration.query(
+            ancestor=prof.key).fetch_page(request.pageSize or MAX_PAGE_SIZE,
+            start_cursor=cursor)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        conferences = ndb.get_multi([reg.conference for reg in regs])
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, 
-            names[conf.organizerUserId]) for conf in conferences]
+        copier = self._conferenceCopier(fields)
+        return ConferenceForms(items=[copier(conf)
+            for conf in conferences if conf],
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+
+    # Get the attendees of a conference you have created
+    @endpoints.method(CONF_PAGE_REQUEST, AttendeeForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return the users registered for a conference, to its organizer."""
+        prof = self._getProfileFromUser() # get user Profile
+        cursor = self._getPageCursor(request)
+
+        conf = self._getConference(request.websafeConferenceKey)
+        if prof.key.id() != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can see the attendees of the conference.')
+
+        regs, next_cursor, more = Registration.query(
+            Registration.conference == conf.key).order(
+            Registration.created).fetch_page(request.pageSize or MAX_PAGE_SIZE,
+            start_cursor=cursor)
+        # each Registration is a child of the attendee's Profile
+        profiles = ndb.get_multi([reg.key.parent() for reg in regs])
+
+        return AttendeeForms(
+            items=[AttendeeForm(displayName=attendee.displayName,
+                mainEmail=attendee.mainEmail, registered=str(reg.created))
+                for reg, attendee in zip(regs, profiles) if attendee],
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+
+    # Use Push Task to move Profile.conferenceKeysToAttend lists into
+    # Registration entities, one batch of profiles per task
+    @staticmethod
+    def _migrateRegistrations(websafeCursor=None):
+        """Create Registrations for a batch of Profiles and queue a task for
+        the next batch, if there is one."""
+        p_keys, cursor, more = Profile.query().fetch_page(
+            REGISTRATION_MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor or None),
+            keys_only=True)
+        for p_key in p_keys:
+            ConferenceApi._migrateProfileRegistrations(p_key)
+
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                url='/tasks/migrate_registrations'
+            )
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateProfileRegistrations(p_key):
+        """Move one Profile's conferenceKeysToAttend into Registrations;
+        both live in the Profile's entity group."""
+        prof = p_key.get()
+        if not prof or not prof.conferenceKeysToAttend:
+            return
+        ndb.put_multi([Registration(
+            key=ndb.Key(Registration, wsck, parent=p_key),
+            conference=ndb.Key(urlsafe=wsck))
+            for wsck in prof.conferenceKeysToAttend])
+        prof.conferenceKeysToAttend = []
+        prof.put()
+        ConferenceApi._cacheProfile(prof)
+
+
+    @staticmethod
+    def _foldLegacyRegistrations(prof):
+        """Move a Profile's conferenceKeysToAttend into Registrations before
+        its registrations are read or changed, so registrations made before
+        Registration entities count without waiting for the migration."""
+        if prof.conferenceKeysToAttend:
+            ConferenceApi._migrateProfileRegistrations(prof.key)
+
+
+# - - - Conference key migration - - - - - - - - - - - - - - -
+
+    # Use Push Task to move Conferences to root keys, a few per task
+    @staticmethod
+    def _migrateConferenceKeys(websafeCursor=None):
+        """Move a batch of Conferences created under their organizer's
+        Profile to root keys, and queue a task for the next batch, if there
+        is one."""
+        # in ancestor mode getConferencesCreated only finds conferences
+        # under the organizer's Profile, so leave them there
+        if not ROOT_CONFERENCE_KEYS:
+            return
+        c_keys, cursor, more = Conference.query().fetch_page(
+            CONFERENCE_KEY_MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=websafeCursor or None),
+            keys_only=True)
+        for c_key in c_keys:
+            if c_key.parent():
+                ConferenceApi._moveConference(c_key)
+
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                url='/tasks/migrate_conference_keys'
+            )
+
+
+    @staticmethod
+    def _copyEntity(entity, key):
+        """Return a copy of entity under a new key, without properties its
+        model no longer declares."""
+        model = type(entity)
+        return model(key=key, **entity.to_dict(include=[prop._code_name
+            for prop in model._properties.values()]))
+
+
+    @staticmethod
+    def _moveConference(old_key):
+        """Move one Conference to a root key, with its Sessions, speakers,
+        seats, Registrations and the Profile, Speaker and announcement
+        references to them. The MovedConference is written first: from
+        then on writes to the old conference are refused (_checkNotMoving,
+        and the frozen seat shards for registrations). Registrations and
+        Profiles are found with global queries, which can miss recent
+        writes, so a delayed task looks for them again before the old
+        entities are deleted (_finishConferenceMove); after that the old
+        key is followed to the new one (_getConference). Every step can be
+        repeated, so a retried task finishes the move."""
+        if not old_key.get():
+            return
+        old_wsck = old_key.urlsafe()
+        moved = MovedConference.get_or_insert(old_wsck,
+            conference=CONFERENCE_IDS.allocateKey())
+        new_key = moved.conference
+        new_wsck = new_key.urlsafe()
+        # read again now that no transaction can change it
+        conf = old_key.get(use_cache=False)
+        sessions = Session.query(ancestor=old_key).fetch()
+        session_keys = ConferenceApi._movedSessionKeys(
+            [session.key for session in sessions], new_key)
+
+        # copy the Conference and its children, unless a previous try did:
+        # the copies may have changed since; Sessions keep their ids
+        # under the new parent
+        if not moved.copied:
+            speakers = ConferenceSpeaker.query(ancestor=old_key).fetch()
+            sv = ConferenceApi._sessionsVersionKey(old_key).get()
+            moved_conf = ConferenceApi._copyEntity(conf, new_key)
+            entities = [moved_conf]
+            for session in sessions:
+                entities.append(ConferenceApi._copyEntity(session,
+                    session_keys[session.key]))
+            for cs in speakers:
+                copied = ConferenceApi._copyEntity(cs,
+                    ndb.Key(ConferenceSpeaker, cs.key.id(), parent=new_key))
+                copied.sessionKeys = [session_keys.get(s_key, s_key)
+                    for s_key in cs.sessionKeys]
+                entities.append(copied)
+            if sv:
+                entities.append(ConferenceApi._copyEntity(sv,
+                    ConferenceApi._sessionsVersionKey(new_key)))
+            old_shards = [ConferenceApi._freezeSeatShard(s_key)
+                for s_key in ConferenceApi._seatShardKeys(conf)]
+            entities.extend(SeatShard(
+                key=ndb.Key(SeatShard, '%s:%d' % (new_wsck, i)),
+                seatsAvailable=shard.seatsAvailable)
+                for i, shard in enumerate(old_shards))
+            ndb.put_multi(entities)
+            # keep the new conference's own allocations clear of the
+            # copied ids
+            session_ids = [s_key.id() for s_key in session_keys
+                if isinstance(s_key.id(), (int, long))]
+            if session_ids:
+                Session.allocate_ids(max=max(session_ids), parent=new_key)
+            moved.copied = True
+            moved.put()
+        else:
+            moved_conf = new_key.get()
+
+        ConferenceApi._moveConferenceReferences(old_key, new_key,
+            session_keys)
+        for speaker in set(session.speaker for session in sessions
+                           if session.speaker):
+            ConferenceApi._replaceSpeakerSessions(speaker, session_keys)
+        if moved_conf:
+            ConferenceApi._moveNearlySoldOut(old_wsck, moved_conf)
+        ConferenceApi._bumpConferenceGeneration()
+        taskqueue.add(params={'websafeConferenceKey': old_wsck},
+            url='/tasks/finish_conference_move',
+            countdown=CONFERENCE_MOVE_SETTLE_SECONDS
         )
 
 
+    @staticmethod
+    def _finishConferenceMove(old_wsck):
+        """Move the Registrations and Profile references the first pass of
+        _moveConference could not see yet, then delete the old Conference
+        and its children."""
+        old_key = ndb.Key(urlsafe=old_wsck)
+        moved = MovedConference.get_by_id(old_wsck)
+        conf = old_key.get(use_cache=False)
+        if not moved or not moved.copied or not conf:
+            return
+        session_keys = ConferenceApi._movedSessionKeys(
+            Session.query(ancestor=old_key).fetch(keys_only=True),
+            moved.conference)
+        ConferenceApi._moveConferenceReferences(old_key, moved.conference,
+            session_keys)
+
+        # finally drop the old entities
+        ndb.delete_multi([old_key] + list(session_keys) +
+            ConferenceSpeaker.query(ancestor=old_key).fetch(keys_only=True) +
+            [ConferenceApi._sessionsVersionKey(old_key),
+             ConferenceApi._sessionTypeIndexKey(old_key)] +
+            ConferenceApi._seatShardKeys(conf))
+        memcache.delete(MEMCACHE_FEATURED_SPEAKER_TPL % old_wsck)
+        ConferenceApi._bumpConferenceGeneration()
+
+
+    @staticmethod
+    def _movedSessionKeys(s_keys, new_key):
+        """Return a dict of old Session keys to their keys under new_key."""
+        return dict((s_key, ndb.Key(Session, s_key.id(), parent=new_key))
+            for s_key in s_keys)
+
+
+    @staticmethod
+    def _moveConferenceReferences(old_key, new_key, session_keys):
+        """Point the Registrations for a moved conference, and the keys of
+        it and its sessions (session_keys, a dict of old to new keys) held
+        in Profiles, at the new keys."""
+        # Registrations are keyed by the websafe conference key
+        new_wsck = new_key.urlsafe()
+        regs = Registration.query(Registration.conference == old_key).fetch()
+        ndb.put_multi([Registration(
+            key=ndb.Key(Registration, new_wsck, parent=reg.key.parent()),
+            conference=new_key, created=reg.created) for reg in regs])
+        ndb.delete_multi([reg.key for reg in regs])
+
+        old_wsck = old_key.urlsafe()
+        wscks = {old_wsck: new_wsck}
+        wscks.update((old.urlsafe(), new.urlsafe())
+            for old, new in session_keys.items())
+        p_keys = set(Profile.query(
+            Profile.conferenceKeysToAttend == old_wsck).iter(keys_only=True))
+        old_wscks = sorted(wscks)
+        old_session_keys = sorted(session_keys)
+        # IN takes at most 30 values
+        for i in range(0, len(old_wscks), 30):
+            p_keys.update(Profile.query(Profile.legacySessionKeysForWishlist.IN(
+                old_wscks[i:i + 30])).iter(keys_only=True))
+        for i in range(0, len(old_session_keys), 30):
+            p_keys.update(Profile.query(Profile.sessionKeysForWishlist.IN(
+                old_session_keys[i:i + 30])).iter(keys_only=True))
+        for p_key in p_keys:
+            ConferenceApi._replaceProfileKeys(p_key, wscks, session_keys)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _freezeSeatShard(shard_key):
+        """Stop registrations taking or giving back seats of a shard of a
+        conference being moved; returns the frozen shard."""
+        shard = shard_key.get() or SeatShard(key=shard_key)
+        if not shard.frozen:
+            shard.frozen = True
+            shard.put()
+        return shard
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _replaceProfileKeys(p_key, wscks, session_keys):
+        """Replace the keys in a Profile's lists using wscks, a dict of old
+        to new websafe keys, and session_keys, a dict of old to new keys."""
+        prof = p_key.get()
+        if not prof:
+            return
+        attend = [wscks.get(wsck, wsck) for wsck in prof.conferenceKeysToAttend]
+        wishlist = [session_keys.get(s_key, s_key)
+            for s_key in wishlistKeys(prof)]
+        if (attend != prof.conferenceKeysToAttend or
+                wishlist != wishlistKeys(prof)):
+            prof.conferenceKeysToAttend = attend
+            prof.sessionKeysForWishlist = wishlist
+            prof.legacySessionKeysForWishlist = []
+            prof.put()
+            ConferenceApi._cacheProfile(prof)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _replaceSpeakerSessions(speaker, session_keys):
+        """Replace the session keys in a speaker's index entry using
+        session_keys, a dict of old to new keys."""
+        spkr = ConferenceApi._speakerKey(speaker).get()
+        if not spkr:
+            return
+        moved = [session_keys.get(s_key, s_key) for s_key in spkr.sessionKeys]
+        if moved != spkr.sessionKeys:
+            spkr.sessionKeys = moved
+            spkr.put()
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _moveNearlySoldOut(old_wsck, conf):
+        """Rename a moved conference among the nearly sold out ones."""
+        nso = NEARLY_SOLD_OUT_KEY.get()
+        if not nso or old_wsck not in nso.conferences:
+            return
+        del nso.conferences[old_wsck]
+        if ConferenceApi._isNearlySoldOut(conf.seatsAvailable):
+            nso.conferences[conf.key.urlsafe()] = conf.name
+        nso.put()
+        ndb.get_context().call_on_commit(
+            lambda: ConferenceApi._setAnnouncement(nso))
+
+
+# - - - Key reference migration - - - - - - - - - - - - - - -
+
+    # Use Push Task to replace websafe key strings with keys, one batch
+    # per task: Profiles first, then Sessions
+    @staticmethod
+    def _migrateKeyReferences(kind='profile', websafeCursor=None):
+        """Convert the key references of a batch of Profiles or Sessions,
+        and queue a task for the next batch, if there is one."""
+        cursor = Cursor(urlsafe=websafeCursor or None)
+        if kind == 'profile':
+            p_keys, cursor, more = Profile.query().fetch_page(
+                KEY_REFERENCE_MIGRATION_BATCH_SIZE, start_cursor=cursor,
+                keys_only=True)
+            for p_key in p_keys:
+                # the key typed form of conferenceKeysToAttend is
+                # Registration.conference
+                ConferenceApi._migrateProfileRegistrations(p_key)
+                ConferenceApi._migrateWishlistKeys(p_key)
+        else:
+            sessions, cursor, more = Session.query().fetch_page(
+                KEY_REFERENCE_MIGRATION_BATCH_SIZE, start_cursor=cursor)
+            # Sessions aren't edited after they are created, so there is
+            # no write to race with
+            ndb.put_multi([session for session in sessions
+                if ConferenceApi._dropUndeclaredProperties(session)])
+
+        if more and cursor:
+            params = {'kind': kind, 'cursor': cursor.urlsafe()}
+        elif kind == 'profile':
+            params = {'kind': 'session'}
+        else:
+            return
+        taskqueue.add(params=params, url='/tasks/migrate_key_references')
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateWishlistKeys(p_key):
+        """Move one Profile's websafe wishlist keys into its key list."""
+        prof = p_key.get()
+        if not prof or not prof.legacySessionKeysForWishlist:
+            return
+        prof.sessionKeysForWishlist = wishlistKeys(prof)
+        prof.legacySessionKeysForWishlist = []
+        prof.put()
+        ConferenceApi._cacheProfile(prof)
+
+
+    @staticmethod
+    def _dropUndeclaredProperties(entity):
+        """Remove the properties an entity was read with that its model
+        no longer declares, such as Session.websafeConferenceKey; returns
+        whether there were any."""
+        declared = type(entity)._properties
+        undeclared = [name for name in entity._properties
+            if name not in declared]
+        for name in undeclared:
+            # ndb gave the entity its own copy of _properties for these
+            del entity._properties[name]
+            entity._values.pop(name, None)
+        return bool(undeclared)
+
+
     # Register for conference - update registration status
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
@@ -981,7 +2453,7 @@ class ConferenceApi(remote.Service):
 
 
     # Endpoint to test using filters in queries
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(FIELDS_REQUEST, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
     def filterPlayground(self, request):
@@ -991,9 +2463,14 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.topics=="Medical Innovations")
         q = q.filter(Conference.month==6)
 
+        fields = self._parseFieldMask(request.fieldMask, ConferenceForm)
+        confs, _, _ = self._fetchPage(q, projection=self._projectionFor(
+            Conference, fields, ['city', 'topics', 'month']))
+        copier = self._conferenceCopier(fields)
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=[copier(conf) for conf in confs]
         )
 
 
-api = endpoints.api_server([ConferenceApi]) # register API
+# register API; ndb.toplevel lets async writes finish before the response
+api = ndb.toplevel(endpoints.api_server([ConferenceApi]))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+ids.py -- Udacity conference server-side Python App Engine
+    in-instance allocation of datastore ids from reserved blocks
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+import collections
+import threading
+
+from google.appengine.ext import ndb
+
+ID_BLOCK_SIZE = 20
+ID_REFILL_AT = 5
+MAX_ID_POOLS = 1000
+
+
+class _IdPool(object):
+    """The unused ids reserved for one model & parent, as [next, last]
+    ranges."""
+
+    def __init__(self):
+        self.ranges = collections.deque()
+        self.refilling = False
+
+    def remaining(self):
+        return sum(last - nxt + 1 for nxt, last in self.ranges)
+
+    def take(self):
+        """Return the next id, or None if the pool is empty."""
+        while self.ranges:
+            nxt, last = self.ranges[0]
+            if nxt > last:
+                self.ranges.popleft()
+                continue
+            self.ranges[0] = (nxt + 1, last)
+            return nxt
+        return None
+
+    def add(self, first, last):
+        if first <= last:
+            self.ranges.append((first, last))
+
+
+class IdAllocator(object):
+    """Hands out keys for a model from blocks of ids reserved with
+    allocate_ids, one pool per parent key (None for root entities), so
+    that most creations don't wait on an allocate_ids RPC. Thread safe.
+
+    When a pool runs low it is refilled with allocate_ids_async; the
+    request that starts the refill waits for it only at its end (the API
+    runs under ndb.toplevel). Only an empty pool allocates synchronously.
+    Ids left in a pool when the instance goes away are never used."""
+
+    def __init__(self, model, blockSize=ID_BLOCK_SIZE, refillAt=ID_REFILL_AT,
+                 maxPools=MAX_ID_POOLS):
+        self.model = model
+        self.blockSize = blockSize
+        self.refillAt = refillAt
+        self.maxPools = maxPools
+        self._pools = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pool(self, parent):
+        """Return the pool for parent, most recently used last; called
+        with the lock held."""
+        pool = self._pools.pop(parent, None) or _IdPool()
+        self._pools[parent] = pool
+        while len(self._pools) > self.maxPools:
+            self._pools.popitem(last=False)
+        return pool
+
+    def allocateKey(self, parent=None):
+        """Return a new, unused key for the model under parent."""
+        with self._lock:
+            pool = self._pool(parent)
+            m_id = pool.take()
+            refill = (m_id is not None and not pool.refilling and
+                      pool.remaining() <= self.refillAt)
+            if refill:
+                pool.refilling = True
+
+        if m_id is None:
+            first, last = self.model.allocate_ids(size=self.blockSize,
+                parent=parent)
+            with self._lock:
+                pool.add(first + 1, last)
+            m_id = first
+        elif refill:
+            future = self.model.allocate_ids_async(size=self.blockSize,
+                parent=parent)
+            future.add_callback(self._refilled, pool, future)
+        return ndb.Key(self.model, m_id, parent=parent)
+
+    def _refilled(self, pool, future):
+        """Add an asynchronously allocated block to its pool."""
+        exception = future.get_exception()
+        with self._lock:
+            pool.refilling = False
+            if not exception:
+                first, last = future.get_result()
+                pool.add(first, last)
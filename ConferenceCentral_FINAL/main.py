@@ -12,10 +12,25 @@ created by wesc on 2014 may 24
 
 __author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
 
+import json
+import os
+
+import endpoints
 import webapp2
 from google.appengine.api import app_identity
+from google.appengine.api import datastore_errors
 from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from protorpc import protojson
+import auth
+import bulk
+import utils
 from conference import ConferenceApi
+from conference import PROFILES
+from models import Profile
+from settings import ROOT_CONFERENCE_KEYS
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -24,6 +39,18 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class SetFieldStatisticsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recounting Conference field values for the query planner."""
+        ConferenceApi._startFieldStatisticsRecount()
+        self.response.set_status(204)
+
+    def post(self):
+        """Count the field values of a page of Conferences."""
+        ConferenceApi._recountFieldStatistics(self.request.get('cursor'))
+        self.response.set_status(204)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
@@ -41,13 +68,214 @@ class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Set Featured Speaker in Memcache."""
         ConferenceApi._cacheFeaturedSpeaker(
-            self.request.get('newSessionSpeaker'),
+            self.request.get_all('websafeSessionKey'))
+        self.response.set_status(204)
+
+class UpdateOrganizerDisplayNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy organizer displayName onto their Conferences."""
+        ConferenceApi._updateOrganizerDisplayName(
+            self.request.get('organizerUserId'),
+            self.request.get('cursor'))
+        self.response.set_status(204)
+
+
+class BackfillOrganizerDisplayNamesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Queue a displayName update for every Profile."""
+        tasks = []
+        for p_key in Profile.query().iter(keys_only=True):
+            tasks.append(taskqueue.Task(
+                params={'organizerUserId': p_key.id()},
+                url='/tasks/update_organizer_display_name'))
+            # the task queue accepts at most 100 tasks per call
+            if len(tasks) == 100:
+                taskqueue.Queue().add(tasks)
+                tasks = []
+        if tasks:
+            taskqueue.Queue().add(tasks)
+        self.response.set_status(204)
+
+class BackfillSpeakerIndexHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start indexing existing Sessions by speaker."""
+        taskqueue.add(url='/tasks/backfill_speaker_index')
+        self.response.set_status(204)
+
+    def post(self):
+        """Index a batch of Sessions by speaker."""
+        ConferenceApi._backfillSpeakerIndex(self.request.get('cursor'))
+        self.response.set_status(204)
+
+class UpdateSeatsAvailableHandler(webapp2.RequestHandler):
+    def post(self):
+        """Total a Conference's seat shards."""
+        ConferenceApi._updateSeatsAvailable(
             self.request.get('websafeConferenceKey'))
         self.response.set_status(204)
 
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving Profile registrations into Registration entities."""
+        taskqueue.add(url='/tasks/migrate_registrations')
+        self.response.set_status(204)
+
+    def post(self):
+        """Move a batch of Profile registrations."""
+        ConferenceApi._migrateRegistrations(self.request.get('cursor'))
+        self.response.set_status(204)
+
+class MigrateConferenceKeysHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving Conferences to root keys."""
+        if not ROOT_CONFERENCE_KEYS:
+            self.abort(400, 'Set ROOT_CONFERENCE_KEYS in settings.py first.')
+        taskqueue.add(url='/tasks/migrate_conference_keys')
+        self.response.set_status(204)
+
+    def post(self):
+        """Move a batch of Conferences."""
+        if not ROOT_CONFERENCE_KEYS:
+            self.abort(400, 'Set ROOT_CONFERENCE_KEYS in settings.py first.')
+        ConferenceApi._migrateConferenceKeys(self.request.get('cursor'))
+        self.response.set_status(204)
+
+class FinishConferenceMoveHandler(webapp2.RequestHandler):
+    def post(self):
+        """Catch up on a moved Conference's references and delete the old
+        entities."""
+        ConferenceApi._finishConferenceMove(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class MigrateKeyReferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start replacing websafe key strings with keys."""
+        taskqueue.add(url='/tasks/migrate_key_references')
+        self.response.set_status(204)
+
+    def post(self):
+        """Convert the key references of a batch of entities."""
+        ConferenceApi._migrateKeyReferences(
+            self.request.get('kind', 'profile'),
+            self.request.get('cursor'))
+        self.response.set_status(204)
+
+class ImportHandler(webapp2.RequestHandler):
+    def post(self, kind):
+        """Import entities of one kind from a JSONL or CSV request body."""
+        # only the query string: reading form params would use up the body
+        fmt = self.request.GET.get('format', 'jsonl')
+        try:
+            count = bulk.importRecords(kind,
+                bulk.readRecords(self.request.body_file, fmt))
+        except (KeyError, ValueError, datastore_errors.BadValueError) as e:
+            self.abort(400, 'Invalid %s record: %s' % (kind, e))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'imported': count}))
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self, kind):
+        """Export one page of the entities of a kind as JSONL or CSV; the
+        X-Next-Cursor header gives the cursor for the next page."""
+        fmt = self.request.get('format', 'jsonl')
+        if fmt not in ('jsonl', 'csv'):
+            self.abort(400, 'Unknown format: %s' % fmt)
+        self.response.headers['Content-Type'] = (
+            'text/csv' if fmt == 'csv' else 'application/x-ndjson')
+        next_cursor = bulk.exportPage(kind, fmt, self.response.out,
+            self.request.get('cursor'))
+        if next_cursor:
+            self.response.headers['X-Next-Cursor'] = next_cursor
+
+
+class ConditionalGetHandler(webapp2.RequestHandler):
+    """Base for the read-only JSON routes that clients poll: Endpoints
+    can only answer with a body or an error, so a 304 Not Modified has
+    to come from a plain handler."""
+
+    def writeForm(self, version, makeForm):
+        """Write the form makeForm() returns as JSON, with version as its
+        ETag; if the If-None-Match request header already names that
+        version, answer 304 without calling makeForm."""
+        # the browser must check back every time; proxies mustn't keep it
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        self.response.etag = str(version)
+        if str(version) in self.request.if_none_match:
+            self.response.set_status(304)
+            return
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(protojson.encode_message(makeForm()))
+
+
+class ConferenceHandler(ConditionalGetHandler):
+    def get(self, websafeConferenceKey):
+        """Return a conference, as getConference does."""
+        api = ConferenceApi()
+        try:
+            conf = api._getConference(websafeConferenceKey)
+        except endpoints.NotFoundException as e:
+            self.abort(404, str(e))
+        self.writeForm(conf.version, lambda: api._copyConferenceToForm(conf))
+
+
+class ConferenceSessionsHandler(ConditionalGetHandler):
+    def get(self, websafeConferenceKey):
+        """Return a conference's sessions, as getConferenceSessions does
+        without a fieldMask; the caller must be signed in."""
+        if not auth.currentUser(ConferenceApi.getConferenceSessions,
+                                ConferenceApi.api_info):
+            self.abort(401, 'Authorization required')
+        api = ConferenceApi()
+        try:
+            c_key, version = api._getSessionsVersion(websafeConferenceKey)
+        except endpoints.NotFoundException as e:
+            self.abort(404, str(e))
+        self.writeForm(version,
+            lambda: api._conferenceSessionForms(c_key, version, None))
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the hit counters of this instance's caches, and of
+        memcache as a whole, as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'instance': os.environ.get('INSTANCE_ID'),
+            'profiles': PROFILES.stats(),
+            'userIds': utils.USER_IDS.stats(),
+            'tokenInfo': utils.TOKENINFO.stats(),
+            'verifiedTokens': auth.VERIFIED_TOKENS.stats(),
+            'signingCerts': auth.SIGNING_CERTS.stats(),
+            'memcache': memcache.get_stats(),
+        }))
+
 
-app = webapp2.WSGIApplication([
+# like the API, wait for asynchronous work (such as id block refills)
+# before the request ends, so none of it is abandoned
+app = ndb.toplevel(webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/set_field_statistics', SetFieldStatisticsHandler),
+    ('/tasks/update_field_statistics', SetFieldStatisticsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
-], debug=True)
+    ('/tasks/update_organizer_display_name', UpdateOrganizerDisplayNameHandler),
+    ('/tasks/backfill_speaker_index', BackfillSpeakerIndexHandler),
+    ('/tasks/update_seats_available', UpdateSeatsAvailableHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/migrate_conference_keys', MigrateConferenceKeysHandler),
+    ('/tasks/finish_conference_move', FinishConferenceMoveHandler),
+    ('/tasks/migrate_key_references', MigrateKeyReferencesHandler),
+    ('/admin/backfill_organizer_display_names',
+        BackfillOrganizerDisplayNamesHandler),
+    ('/admin/backfill_speaker_index', BackfillSpeakerIndexHandler),
+    ('/admin/migrate_registrations', MigrateRegistrationsHandler),
+    ('/admin/migrate_conference_keys', MigrateConferenceKeysHandler),
+    ('/admin/migrate_key_references', MigrateKeyReferencesHandler),
+    ('/admin/import/(conference|session|profile|registration)', ImportHandler),
+    ('/admin/export/(conference|session|profile|registration)', ExportHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+    ('/api/conference/([^/]+)', ConferenceHandler),
+    ('/api/conference/([^/]+)/sessions', ConferenceSessionsHandler),
+], debug=True))
@@ -26,8 +26,23 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionKeysForWishlist = ndb.StringProperty(repeated=True) # New for wishlist 
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True) # legacy, see Registration
+    sessionKeysForWishlist = ndb.KeyProperty('sessionWishlist', kind='Session', repeated=True)
+    legacySessionKeysForWishlist = ndb.StringProperty('sessionKeysForWishlist', repeated=True) # legacy websafe keys
+
+class Registration(ndb.Model):
+    """Registration -- a user's registration for a conference; child of the
+    user's Profile, with the conference's websafe key as its id so that it
+    can be looked up by user & conference. The id is never decoded: the
+    conference is read from the conference property"""
+    conference  = ndb.KeyProperty(kind='Conference', required=True)
+    created     = ndb.DateTimeProperty(auto_now_add=True)
+
+class UserIdentity(ndb.Model):
+    """UserIdentity -- the generated user id for an email, keyed by the
+    email; used by getUserId(id_type="custom")"""
+    userId  = ndb.StringProperty(indexed=False, required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -42,6 +57,17 @@ class ProfileForm(messages.Message):
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     sessionKeysForWishlist = messages.StringField(5, repeated=True)
 
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- outbound form message for a conference attendee"""
+    displayName = messages.StringField(1)
+    mainEmail = messages.StringField(2)
+    registered = messages.StringField(3)
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- multiple AttendeeForm outbound form message"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
@@ -62,6 +88,48 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    version         = ndb.IntegerProperty(default=0, indexed=False)
+
+    def _pre_put_hook(self):
+        # every write is a new version, whichever code path makes it
+        self.version += 1
+
+class MovedConference(ndb.Model):
+    """MovedConference -- records the root key a Conference created under
+    its organizer's Profile was moved to; keyed by the old websafe key, as
+    that is what requests for the old conference name"""
+    conference = ndb.KeyProperty(kind='Conference', indexed=False)
+    copied     = ndb.BooleanProperty(default=False, indexed=False) # old entities still to be deleted
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats; a root
+    entity keyed by '<websafeConferenceKey>:<n>' so that registrations
+    don't contend on the Conference entity group. The keys are built from
+    the Conference's key and seatShards; the ids are never decoded"""
+    seatsAvailable = ndb.IntegerProperty(default=0, indexed=False)
+    frozen         = ndb.BooleanProperty(default=False, indexed=False) # conference is being moved
+
+class FieldStatistics(ndb.Model):
+    """FieldStatistics -- per-value counts of a Conference field, keyed by
+    field name; used to plan queries with more than one inequality"""
+    total   = ndb.IntegerProperty(indexed=False)
+    counts  = ndb.JsonProperty()    # list of [value, count] pairs
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+class FieldStatisticsRecount(ndb.Model):
+    """FieldStatisticsRecount -- the counts of a FieldStatistics recount in
+    progress, a page of Conferences per task; a single entity"""
+    cursor  = ndb.StringProperty(indexed=False)  # where the next page starts
+    total   = ndb.IntegerProperty(default=0, indexed=False)
+    counts  = ndb.JsonProperty()    # field name to list of [value, count] pairs
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- the conferences that are nearly sold out, as a dict
+    of websafe conference key to conference name (JSON keys are strings);
+    a single entity"""
+    conferences = ndb.JsonProperty()
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,15 +145,16 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    version         = messages.IntegerField(13)
 
 # Handle returning a list of conferences 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 class Session(ndb.Model):
-    """Session -- Session object"""
-    websafeConferenceKey    = ndb.StringProperty()
+    """Session -- Session object; child of its Conference"""
     name                    = ndb.StringProperty(required=True)
     highlights              = ndb.StringProperty()
     speaker                 = ndb.StringProperty()
@@ -94,6 +163,30 @@ class Session(ndb.Model):
     date                    = ndb.DateProperty()
     startTime               = ndb.TimeProperty()
 
+class Speaker(ndb.Model):
+    """Speaker -- index of a speaker's sessions, keyed by normalized name"""
+    name        = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+
+class ConferenceSpeaker(ndb.Model):
+    """ConferenceSpeaker -- a speaker's sessions in one conference; child of
+    the Conference, keyed by normalized speaker name"""
+    speaker      = ndb.StringProperty(indexed=False)
+    numSessions  = ndb.IntegerProperty(default=0)
+    sessionKeys  = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+
+class SessionsVersion(ndb.Model):
+    """SessionsVersion -- version of a conference's set of sessions; child
+    of the Conference, bumped in the transaction that writes sessions"""
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+class SessionTypeIndex(ndb.Model):
+    """SessionTypeIndex -- a conference's sessions by typeOfSession, as a
+    dict of type to [date & startTime, session id] pairs in time order;
+    child of the Conference, updated with its SessionsVersion"""
+    types = ndb.JsonProperty()
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     websafeConferenceKey    = messages.StringField(1)
@@ -108,6 +201,7 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    version = messages.IntegerField(2)
 
 
 class SessionWishlist(ndb.Model):
@@ -120,12 +214,14 @@ SESSION_CONTAINER = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey = messages.StringField(1),
     typeOfSession = messages.StringField(6, repeated=True), 
+    fieldMask = messages.StringField(9),
     )
 
 
 SPEAKER_CONTAINER = endpoints.ResourceContainer(
     SessionForm,
-    speaker = messages.StringField(4) 
+    speaker = messages.StringField(4),
+    fieldMask = messages.StringField(9),
     )
 
 
@@ -158,6 +254,9 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    fieldMask = messages.StringField(4)
 
 
 class SessionQueryForm(messages.Message):
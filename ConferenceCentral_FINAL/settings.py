@@ -16,3 +16,13 @@ WEB_CLIENT_ID = '218263164487-3eo97mbj1grcu08sp60qq075em9uin64.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Create Conferences as root entities instead of children of the
+# organizer's Profile, so one organizer's conferences don't share an
+# entity group (and its write rate). Existing conferences are moved by
+# /admin/migrate_conference_keys once this is on.
+ROOT_CONFERENCE_KEYS = False
+
+# Google's OAuth2 tokeninfo endpoint, used by getUserId(id_type="oauth");
+# point it at tokeninfo_stub.py to load test that path offline.
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, $window, oauth2Provider, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -293,6 +293,26 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the token of the next page of the 'ALL' tab, null when there are no more pages.
+     * @type {string}
+     */
+    $scope.nextPageToken = null;
+
+    /**
+     * The number of conferences requested from the server per page.
+     * @type {number}
+     */
+    $scope.serverPageSize = 20;
+
+    /**
+     * The conference fields shown in the list, so that the server leaves out
+     * the rest (description, topics, ...).
+     * @type {string}
+     */
+    $scope.listFields = 'items(websafeKey,name,city,startDate,organizerDisplayName,' +
+        'maxAttendees,seatsAvailable),nextPageToken';
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -379,6 +399,45 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         return angular.element(event.target).hasClass('disabled');
     }
 
+    /**
+     * Returns the index of the first conference displayed.
+     * The 'ALL' tab is scrolled infinitely, so it always starts from the first conference.
+     *
+     * @returns {number}
+     */
+    $scope.pagination.startIndex = function () {
+        if ($scope.selectedTab == 'ALL') {
+            return 0;
+        }
+        return $scope.pagination.currentPage * $scope.pagination.pageSize;
+    };
+
+    /**
+     * Returns the number of the conferences displayed.
+     *
+     * @returns {number}
+     */
+    $scope.pagination.limit = function () {
+        if ($scope.selectedTab == 'ALL') {
+            return $scope.conferences.length;
+        }
+        return $scope.pagination.pageSize;
+    };
+
+    /**
+     * Loads the next page of the 'ALL' tab when the window is scrolled near its bottom.
+     */
+    var onWindowScroll = function () {
+        var bottom = $window.pageYOffset + $window.innerHeight;
+        if (bottom >= $window.document.body.offsetHeight - 200) {
+            $scope.$apply($scope.loadMoreConferences);
+        }
+    };
+    angular.element($window).bind('scroll', onWindowScroll);
+    $scope.$on('$destroy', function () {
+        angular.element($window).unbind('scroll', onWindowScroll);
+    });
+
     /**
      * Adds a filter and set the default value.
      */
@@ -426,9 +485,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     /**
      * Invokes the conference.queryConferences API.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (loadMore) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.serverPageSize,
+            fieldMask: $scope.listFields
+        }
+        if (loadMore) {
+            sendFilters.pageToken = $scope.nextPageToken;
+        } else {
+            $scope.nextPageToken = null;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -458,22 +524,34 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!loadMore) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
             });
     }
 
+    /**
+     * Appends the next page of the conferences to the 'ALL' tab, if there is one.
+     */
+    $scope.loadMoreConferences = function () {
+        if ($scope.selectedTab == 'ALL' && $scope.nextPageToken && !$scope.loading) {
+            $scope.queryConferencesAll(true);
+        }
+    };
+
     /**
      * Invokes the conference.getConferencesCreated method.
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferencesCreated({fieldMask: $scope.listFields}).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -511,7 +589,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
+        gapi.client.conference.getConferencesToAttend({fieldMask: $scope.listFields}).
             execute(function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
@@ -547,9 +625,15 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, $interval, $http, HTTP_ERRORS) {
     $scope.conference = {};
 
+    /**
+     * How often the page checks the conference for changes, in milliseconds.
+     * @type {number}
+     */
+    var REFRESH_INTERVAL = 30000;
+
     $scope.isUserAttending = false;
 
     /**
@@ -579,6 +663,12 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
             });
         });
 
+        // Keeps the seats available up to date while the page is open.
+        var refresh = $interval($scope.refreshConference, REFRESH_INTERVAL);
+        $scope.$on('$destroy', function () {
+            $interval.cancel(refresh);
+        });
+
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
         gapi.client.conference.getProfile().execute(function (resp) {
@@ -602,6 +692,29 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
     };
 
 
+    /**
+     * Fetches the conference again unless it has changed since it was last fetched.
+     * Endpoints can't answer 304 Not Modified, so the conference is read from the
+     * app's own /api/conference URL, with the version of the conference on the page
+     * in If-None-Match; an unchanged conference is answered with 304 and no body.
+     */
+    $scope.refreshConference = function () {
+        var headers = {};
+        if ($scope.conference.version) {
+            headers['If-None-Match'] = '"' + $scope.conference.version + '"';
+        }
+        $http.get('/api/conference/' + encodeURIComponent($routeParams.websafeConferenceKey),
+            {headers: headers}
+        ).then(function (resp) {
+            $scope.conference = resp.data;
+        }, function (resp) {
+            if (resp.status != 304) {
+                $log.error('Failed to refresh the conference : ' + resp.status);
+            }
+        });
+    };
+
+
     /**
      * Invokes the conference.registerForConference method.
      */
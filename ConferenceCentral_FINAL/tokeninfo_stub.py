@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+tokeninfo_stub.py -- a local stand-in for Google's OAuth2 tokeninfo
+    endpoint, for load testing getUserId(id_type="oauth") offline
+
+Every token is valid and maps to a stable user id derived from it. Run
+it next to the dev server and set TOKENINFO_URL in settings.py to
+http://localhost:8081/tokeninfo:
+
+    python tokeninfo_stub.py --port 8081 --latency 0.1
+
+"""
+
+__author__ = 'plwhetzel@gmail.com (Trish Whetzel)'
+
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import optparse
+import time
+import urlparse
+
+
+class TokenInfoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answer GET /tokeninfo?id_token=... or ?access_token=..."""
+    latency = 0
+    expires_in = 3600
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+        token = (params.get('id_token') or params.get('access_token') or [''])[0]
+        if url.path != '/tokeninfo' or not token:
+            self._reply(400, {'error': 'invalid_token'})
+            return
+        time.sleep(self.latency)
+        user_id = str(int(hashlib.sha1(token).hexdigest()[:15], 16))
+        self._reply(200, {
+            'user_id': user_id,
+            'email': 'user%s@example.com' % user_id,
+            'verified_email': True,
+            'expires_in': self.expires_in,
+        })
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body))
+
+    def log_message(self, format, *args):
+        # keep load tests quiet
+        pass
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=8081)
+    parser.add_option('--latency', type='float', default=0,
+        help='seconds to wait before answering, to mimic the real endpoint')
+    parser.add_option('--expires-in', type='int', default=3600,
+        help='expires_in returned for every token')
+    options, _ = parser.parse_args()
+    TokenInfoHandler.latency = options.latency
+    TokenInfoHandler.expires_in = options.expires_in
+    server = ThreadedHTTPServer(('localhost', options.port), TokenInfoHandler)
+    print 'tokeninfo stub on http://localhost:%d/tokeninfo' % options.port
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
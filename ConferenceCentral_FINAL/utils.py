@@ -1,45 +1,211 @@
+import collections
+import hashlib
 import json
+import operator
 import os
+import threading
 import time
+import urllib
 import uuid
 
 from google.appengine.api import urlfetch
-from models import Profile
+from google.appengine.ext import ndb
+from models import UserIdentity
+from settings import TOKENINFO_URL
+
+TOKENINFO_CACHE_SIZE = 1000
+TOKENINFO_CACHE_TTL = 300
+TOKENINFO_ATTEMPTS = 2
+TOKENINFO_DEADLINE = 5
+MEMCACHE_TOKENINFO_TPL = "TOKENINFO:%s"
+USER_ID_CACHE_SIZE = 1000
+USER_ID_CACHE_TTL = 3600
+
+
+class TTLCache(object):
+    """A bounded, thread safe, in-instance cache. Entries expire after a
+    time to live; when the cache is full the least recently used entry
+    is evicted. Hits and misses are counted, to help size the cache."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value cached for key, or default."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return default
+            # re-insert, so the most recently used entries come last
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Cache value for key, for ttl seconds (default self.ttl)."""
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop key from the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache's size and hit counters as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': float(self.hits) / lookups if lookups else None,
+            }
+
+
+# tokeninfo responses by token digest; memcache is the second tier
+TOKENINFO = TTLCache(TOKENINFO_CACHE_SIZE, TOKENINFO_CACHE_TTL)
+
+
+@ndb.tasklet
+def tokenInfoAsync(token, token_type='id_token'):
+    """Return a Future for the tokeninfo of an OAuth token, or {} if it
+    can't be verified. Answers are cached in the instance and in
+    memcache for as long as the token is valid."""
+    digest = hashlib.sha256(token).hexdigest()
+    info = TOKENINFO.get(digest)
+    if info is not None:
+        raise ndb.Return(info)
+    ctx = ndb.get_context()
+    cached = yield ctx.memcache_get(MEMCACHE_TOKENINFO_TPL % digest)
+    if cached is not None:
+        info, expires = cached
+        TOKENINFO.set(digest, info,
+            min(TOKENINFO_CACHE_TTL, expires - time.time()))
+        raise ndb.Return(info)
+
+    info = {}
+    for i in range(TOKENINFO_ATTEMPTS):
+        url = '%s?%s' % (TOKENINFO_URL, urllib.urlencode({token_type: token}))
+        try:
+            resp = yield ctx.urlfetch(url, deadline=TOKENINFO_DEADLINE)
+        except urlfetch.Error:
+            # retry straight away; never sleep on the request thread
+            continue
+        if resp.status_code == 200:
+            info = json.loads(resp.content)
+            break
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            if token_type == 'access_token':
+                break
+            token_type = 'access_token'
+    if info:
+        # keep the answer no longer than the token itself is valid
+        expires_in = int(info.get('expires_in', TOKENINFO_CACHE_TTL))
+        TOKENINFO.set(digest, info, min(TOKENINFO_CACHE_TTL, expires_in))
+        if expires_in > 0:
+            yield ctx.memcache_set(MEMCACHE_TOKENINFO_TPL % digest,
+                (info, time.time() + expires_in), time=expires_in)
+    raise ndb.Return(info)
+
+
+# generated user ids by email; they never change, and ndb keeps the
+# UserIdentity entities in memcache as the second tier
+USER_IDS = TTLCache(USER_ID_CACHE_SIZE, USER_ID_CACHE_TTL)
+
+
+@ndb.transactional()
+def _createUserIdentity(email):
+    """Return the UserIdentity for an email, creating it if it's new; the
+    transaction makes concurrent first requests agree on one id."""
+    key = ndb.Key(UserIdentity, email)
+    identity = key.get()
+    if not identity:
+        identity = UserIdentity(key=key, userId=uuid.uuid4().hex)
+        identity.put()
+    return identity
+
+
+@ndb.non_transactional
+def _getCustomUserId(email):
+    """Return the generated user id for an email, creating it on first
+    sight. Runs outside any transaction of the caller, whose entity group
+    the UserIdentity isn't in."""
+    user_id = USER_IDS.get(email)
+    if user_id is None:
+        identity = (ndb.Key(UserIdentity, email).get() or
+            _createUserIdentity(email))
+        user_id = identity.userId
+        USER_IDS.set(email, user_id)
+    return user_id
+
+
+def _getOAuthUserId():
+    """A workaround implementation for getting userid."""
+    auth = os.getenv('HTTP_AUTHORIZATION')
+    bearer, token = auth.split()
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    return tokenInfoAsync(token, token_type).get_result().get('user_id', '')
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
 
     if id_type == "oauth":
-        """A workaround implementation for getting userid."""
-        auth = os.getenv('HTTP_AUTHORIZATION')
-        bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _getOAuthUserId()
 
     if id_type == "custom":
-        # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
-        # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
-        else:
-            return str(uuid.uuid1().get_hex())
+        # a stable generated id per email, looked up by key
+        return _getCustomUserId(user.email())
+
+
+def makeFormCopier(model, message, converters=None, fields=None):
+    """Return a function copying an entity of an ndb model to a new protorpc
+    message. Fields are matched to properties by name once, here, instead
+    of for every record copied; converters maps a field name to a function
+    of the entity returning that field's value. If fields is given, only
+    the fields named in it are copied."""
+    converters = converters or {}
+    getters = []
+    for field in message.all_fields():
+        if fields is not None and field.name not in fields:
+            continue
+        if field.name in converters:
+            getters.append((field.name, converters[field.name]))
+        elif field.name in model._properties:
+            getters.append((field.name, operator.attrgetter(field.name)))
+    # setattr already type checks; only required fields need checking
+    check = any(field.required for field in message.all_fields())
+
+    def copy(entity):
+        msg = message()
+        for name, getter in getters:
+            value = getter(entity)
+            if value is not None:
+                setattr(msg, name, value)
+        if check:
+            msg.check_initialized()
+        return msg
+    return copy